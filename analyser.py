@@ -1,7 +1,42 @@
-import sys
+import argparse
+import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import seaborn as sns
 import matplotlib.pyplot as plt
+import backends
+from dataio import infer_format, read_jsonl_fields, read_table, read_table_chunks
+
+# Columns used by the plots, the only ones read from Parquet/Arrow inputs
+ANALYSIS_COLUMNS = [
+    "detected_language_lang",
+    "text_length",
+    "word_length",
+    "token_count",
+]
+ANALYSIS_SCHEMA = pa.schema(
+    [
+        ("detected_language_lang", pa.string()),
+        ("text_length", pa.float64()),
+        ("word_length", pa.float64()),
+        ("token_count", pa.float64()),
+    ]
+)
+# Log-spaced histogram bins used in streaming mode, covering 1 to 10^9
+BINS_PER_DECADE = 20
+LOG_BIN_EDGES = np.logspace(0, 9, 9 * BINS_PER_DECADE + 1)
+# Streamed columns, with the title, axis label and suffix of their plots
+DISTRIBUTION_PLOTS = {
+    "text_length": ("Text Length", "Text Length (characters)", "_text_length.svg"),
+    "word_length": ("Word Count", "Word Count", "_word_count.svg"),
+    "token_count": ("Token Count", "Token Count", "_token_count.svg"),
+}
+
+
+def plot_path(outpath: str, suffix: str) -> str:
+    """Return the path of a plot saved next to the analysed file."""
+    return os.path.splitext(outpath)[0] + suffix
 
 
 def make_language_plot(data: pd.DataFrame, outpath: str) -> None:
@@ -20,11 +55,9 @@ def make_language_plot(data: pd.DataFrame, outpath: str) -> None:
     plt.ylabel("Count")
     plt.xticks(rotation=45)
     plt.tight_layout()
-    plt.savefig(outpath.replace(".jsonl", "") + "_lang_dist.svg")
+    plt.savefig(plot_path(outpath, "_lang_dist.svg"))
     plt.close()
-    print(
-        f"Saved language distribution plot to {outpath.replace('.jsonl', '') + '_lang_dist.svg'}"
-    )
+    print(f"Saved language distribution plot to {plot_path(outpath, '_lang_dist.svg')}")
 
 
 def make_text_length_plot(data: pd.DataFrame, outpath: str) -> None:
@@ -42,11 +75,9 @@ def make_text_length_plot(data: pd.DataFrame, outpath: str) -> None:
     axs.set_ylabel("Frequency")
     twin_axs.set_ylabel("Cumulative Proportion")
     plt.tight_layout()
-    plt.savefig(outpath.replace(".jsonl", "") + "_text_length.svg")
+    plt.savefig(plot_path(outpath, "_text_length.svg"))
     plt.close()
-    print(
-        f"Saved text length plot to {outpath.replace('.jsonl', '') + '_text_length.svg'}"
-    )
+    print(f"Saved text length plot to {plot_path(outpath, '_text_length.svg')}")
 
 
 def make_word_count_plot(data: pd.DataFrame, outpath: str) -> None:
@@ -64,11 +95,9 @@ def make_word_count_plot(data: pd.DataFrame, outpath: str) -> None:
     axs.set_ylabel("Frequency")
     twin_axs.set_ylabel("Cumulative Proportion")
     plt.tight_layout()
-    plt.savefig(outpath.replace(".jsonl", "") + "_word_count.svg")
+    plt.savefig(plot_path(outpath, "_word_count.svg"))
     plt.close()
-    print(
-        f"Saved word count plot to {outpath.replace('.jsonl', '') + '_word_count.svg'}"
-    )
+    print(f"Saved word count plot to {plot_path(outpath, '_word_count.svg')}")
 
 
 def make_token_count_plot(data: pd.DataFrame, outpath: str) -> None:
@@ -86,11 +115,9 @@ def make_token_count_plot(data: pd.DataFrame, outpath: str) -> None:
     axs.set_ylabel("Frequency")
     twin_axs.set_ylabel("Cumulative Proportion")
     plt.tight_layout()
-    plt.savefig(outpath.replace(".jsonl", "") + "_token_count.svg")
+    plt.savefig(plot_path(outpath, "_token_count.svg"))
     plt.close()
-    print(
-        f"Saved token count plot to {outpath.replace('.jsonl', '') + '_token_count.svg'}"
-    )
+    print(f"Saved token count plot to {plot_path(outpath, '_token_count.svg')}")
 
 
 def generate_analysis_plots(data: pd.DataFrame, outpath: str) -> None:
@@ -101,8 +128,182 @@ def generate_analysis_plots(data: pd.DataFrame, outpath: str) -> None:
     make_token_count_plot(data, outpath)
 
 
+class LogHistogram:
+    """
+    Counts of non-negative values in `LOG_BIN_EDGES` bins, updated one chunk at
+    a time. Values below 1 are counted separately, since they have no place on
+    a log scale, and values beyond the last edge go into the last bin.
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(len(LOG_BIN_EDGES) - 1, dtype=np.int64)
+        self.below = 0
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum()) + self.below
+
+    def update(self, values: np.ndarray) -> None:
+        values = values[~np.isnan(values)]
+        positions = np.searchsorted(LOG_BIN_EDGES, values, side="right") - 1
+        self.below += int((positions < 0).sum())
+        positions = np.minimum(positions[positions >= 0], len(self.counts) - 1)
+        self.counts += np.bincount(positions, minlength=len(self.counts))
+
+    def ecdf(self) -> np.ndarray:
+        """Proportion of values below the upper edge of each bin."""
+        return (self.below + np.cumsum(self.counts)) / max(self.total, 1)
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile, taken as the geometric centre of its bin."""
+        if self.below >= q * self.total:
+            return 0.0
+        position = int(np.searchsorted(self.ecdf(), q))
+        return float(np.sqrt(LOG_BIN_EDGES[position] * LOG_BIN_EDGES[position + 1]))
+
+
+class ReservoirSample:
+    """
+    Uniform random sample of up to `size` rows across all chunks, kept as the
+    rows with the smallest random priorities seen so far.
+    """
+
+    def __init__(self, size: int, seed: int = 0):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.data = pd.DataFrame()
+        self.priorities = np.empty(0)
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        if self.size == 0:
+            return
+        data = pd.concat([self.data, chunk], ignore_index=True)
+        priorities = np.concatenate([self.priorities, self.rng.random(len(chunk))])
+        keep = np.argsort(priorities, kind="stable")[: self.size]
+        self.data = data.iloc[keep].reset_index(drop=True)
+        self.priorities = priorities[keep]
+
+
+class StreamingSummary:
+    """Histograms, language counts and a row sample of the analysis columns."""
+
+    def __init__(self, sample_size: int = 10_000):
+        self.rows = 0
+        self.histograms = {column: LogHistogram() for column in DISTRIBUTION_PLOTS}
+        self.languages = pd.Series(dtype=np.int64)
+        self.sample = ReservoirSample(sample_size)
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        self.rows += len(chunk)
+        for column, histogram in self.histograms.items():
+            if column in chunk.columns:
+                histogram.update(chunk[column].to_numpy(dtype=np.float64))
+        if "detected_language_lang" in chunk.columns:
+            counts = chunk["detected_language_lang"].value_counts()
+            self.languages = self.languages.add(counts, fill_value=0).astype(np.int64)
+        self.sample.update(chunk[[c for c in DISTRIBUTION_PLOTS if c in chunk]])
+
+
+def summarise_table(
+    path: str, chunksize: int = 100_000, sample_size: int = 10_000
+) -> StreamingSummary:
+    """Stream the analysis columns of a file into a summary, one chunk at a time."""
+    summary = StreamingSummary(sample_size)
+    if infer_format(path) == "jsonl":
+        # Arrow's JSON reader works in bytes rather than rows; assume ~1 KB rows
+        chunks = read_jsonl_fields(path, ANALYSIS_SCHEMA, block_size=chunksize * 1024)
+    else:
+        chunks = read_table_chunks(path, chunksize, columns=ANALYSIS_COLUMNS)
+    for chunk in chunks:
+        summary.update(chunk)
+        print(f"\tSummarised {summary.rows} rows")
+    return summary
+
+
+def make_streamed_language_plot(summary: StreamingSummary, outpath: str) -> None:
+    """Generate and save a language distribution plot from the language counts."""
+    counts = summary.languages.sort_values(ascending=False)
+    plt.figure(figsize=(10, 6))
+    sns.barplot(x=counts.index, y=counts.to_numpy())
+    plt.title("Language Distribution")
+    plt.xlabel("Language")
+    plt.ylabel("Count")
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    plt.savefig(plot_path(outpath, "_lang_dist.svg"))
+    plt.close()
+    print(f"Saved language distribution plot to {plot_path(outpath, '_lang_dist.svg')}")
+
+
+def make_streamed_distribution_plot(
+    summary: StreamingSummary, column: str, outpath: str
+) -> None:
+    """
+    Generate and save a distribution plot of a column from its log-binned counts,
+    with the cumulative proportion and, if rows were sampled, a KDE of the sample
+    scaled to the counts.
+    """
+    title, xlabel, suffix = DISTRIBUTION_PLOTS[column]
+    histogram = summary.histograms[column]
+    fig, axs = plt.subplots(figsize=(10, 6))
+    twin_axs = axs.twinx()
+    filled = np.flatnonzero(histogram.counts)
+    if len(filled) > 0:
+        bins = slice(filled[0], filled[-1] + 1)
+        edges = LOG_BIN_EDGES[bins.start : bins.stop + 1]
+        axs.stairs(histogram.counts[bins], edges, fill=True, alpha=0.5, color="C0")
+        twin_axs.plot(edges[1:], histogram.ecdf()[bins], color="orange")
+        sample = summary.sample.data.get(column, pd.Series(dtype=np.float64))
+        sample = np.log10(sample[sample >= 1].to_numpy(dtype=np.float64))
+        if len(sample) > 1 and sample.std() > 0:
+            # KDE in log space, scaled like seaborn's histplot(kde=True)
+            grid = np.linspace(np.log10(edges[0]), np.log10(edges[-1]), 200)
+            density = backends.load("scipy.stats").gaussian_kde(sample)(grid)
+            scale = histogram.counts.sum() / BINS_PER_DECADE
+            axs.plot(10**grid, density * scale, color="C0")
+    axs.set_xscale("log")
+    axs.set_yscale("log")
+    plt.title(f"{title} Distribution")
+    axs.set_xlabel(xlabel)
+    axs.set_ylabel("Frequency")
+    twin_axs.set_ylabel("Cumulative Proportion")
+    plt.tight_layout()
+    plt.savefig(plot_path(outpath, suffix))
+    plt.close()
+    print(f"Saved {title.lower()} plot to {plot_path(outpath, suffix)}")
+
+
+def generate_streamed_analysis_plots(summary: StreamingSummary, outpath: str) -> None:
+    """Generate and save the analysis plots from a streamed summary."""
+    for column, histogram in summary.histograms.items():
+        quantiles = ", ".join(
+            f"p{round(q * 100)}={histogram.quantile(q):,.0f}" for q in (0.5, 0.9, 0.99)
+        )
+        print(f"{column}: {quantiles}")
+        make_streamed_distribution_plot(summary, column, outpath)
+    make_streamed_language_plot(summary, outpath)
+
+
 if __name__ == "__main__":
-    path = sys.argv[-1]
+    parser = argparse.ArgumentParser(description="Plot statistics of a cleaned file.")
+    parser.add_argument("path")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read the file in chunks and plot from histograms and a row sample",
+    )
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=10_000,
+        help="Rows sampled for the KDE curves in streaming mode (0 to skip them)",
+    )
+    args = parser.parse_args()
 
-    data = pd.read_json(path, lines=True)
-    generate_analysis_plots(data, path)
+    if args.stream:
+        summary = summarise_table(args.path, args.chunksize, args.sample)
+        generate_streamed_analysis_plots(summary, args.path)
+    else:
+        data = read_table(args.path, columns=ANALYSIS_COLUMNS)
+        generate_analysis_plots(data, args.path)
@@ -0,0 +1,113 @@
+import importlib
+import subprocess
+import sys
+import threading
+import time
+from types import ModuleType
+
+# Modules imported by each optional backend. They are only imported through
+# `load`, the first time a stage that uses them runs.
+BACKENDS: dict[str, tuple[str, ...]] = {
+    "lingua": ("lingua",),
+    "langdetect": ("langdetect", "langdetect.language"),
+    "pygments": ("pygments.lexers", "pygments.util"),
+    "lxml": ("lxml.html", "lxml.etree"),
+    "bs4": ("bs4",),
+    "presidio": ("presidio_analyzer", "presidio_anonymizer"),
+    "spacy": ("spacy",),
+    "tiktoken": ("tiktoken",),
+    "nltk": ("nltk.tokenize",),
+    "sklearn": ("sklearn.model_selection",),
+    "scipy": ("scipy.stats",),
+}
+# Modules every run imports anyway, left out of the measured backend costs
+BASE_MODULES = ("numpy", "pandas", "pyarrow")
+# Seconds spent importing each module loaded through `load` in this process
+IMPORT_TIMES: dict[str, float] = {}
+# Modules fully imported through `load`. A module is in `sys.modules` while
+# another thread is still importing it, so that alone does not mean it is ready.
+_loaded: dict[str, ModuleType] = {}
+_import_lock = threading.Lock()
+
+
+def load(module: str) -> ModuleType:
+    """Import a backend module on first use, recording how long the import took."""
+    if module in _loaded:
+        return _loaded[module]
+    with _import_lock:
+        if module not in _loaded:
+            start = time.perf_counter()
+            imported = module in sys.modules
+            _loaded[module] = importlib.import_module(module)
+            if not imported:
+                IMPORT_TIMES[module] = time.perf_counter() - start
+    return _loaded[module]
+
+
+def required_backends(config: dict) -> list[str]:
+    """Return the backends the pipeline stages import for a config."""
+    filters: dict = config.get("filters", {})
+    cleaners: dict = config.get("cleaners", {})
+    required = []
+    if filters.get("detect_code", filters.get("filter_code", False)):
+        required.append("pygments")
+    language_tool = filters.get("filter_lang_method", "lingua")
+    required.append("langdetect" if language_tool == "langdetect" else "lingua")
+    html_engine = cleaners.get("html_engine", "lxml")
+    if html_engine in ["lxml", "bs4"]:
+        required.append("lxml")
+    if html_engine == "bs4":
+        required.append("bs4")
+    if filters.get("detect_pii", True):
+        required.append("presidio")
+    required.append(config.get("tokenisation_method", "tiktoken"))
+    splitter: dict = config.get("splitter", {})
+    if splitter != {} and splitter.get("method", "random") == "random":
+        required.append("sklearn")
+    return required
+
+
+def measure_import_cost(backend: str) -> float:
+    """
+    Time importing a backend in a fresh interpreter, after the base modules, so
+    the cost does not depend on what this process has already imported.
+    """
+    modules = BACKENDS[backend]
+    code = (
+        f"import time\n"
+        f"import {', '.join(BASE_MODULES)}\n"
+        f"start = time.perf_counter()\n"
+        f"import {', '.join(modules)}\n"
+        f"print(time.perf_counter() - start)\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def print_import_costs(backends: list[str]) -> float:
+    """Print the import cost of each backend, returning the total."""
+    total = 0.0
+    for backend in backends:
+        try:
+            cost = measure_import_cost(backend)
+        except subprocess.CalledProcessError as e:
+            print(f"\t{backend}: not importable ({e.stderr.strip().splitlines()[-1]})")
+            continue
+        total += cost
+        print(f"\t{backend}: {cost:.3f}s")
+    print(f"\tTotal: {total:.3f}s")
+    return total
+
+
+if __name__ == "__main__":
+    # Startup benchmark: import cost of every backend and of the pipeline modules
+    print("Backend import costs:")
+    print_import_costs(list(BACKENDS))
+    for module in ["processor", "main"]:
+        code = f"import time\nstart = time.perf_counter()\nimport {module}\nprint(time.perf_counter() - start)"
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        print(f"import {module}: {float(result.stdout.strip().splitlines()[-1]):.3f}s")
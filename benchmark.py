@@ -0,0 +1,268 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from functools import partial
+from typing import Callable
+
+import pandas as pd
+
+from htmlclean import HtmlEngine
+from processor import (
+    LanguageTool,
+    check_text_is_code,
+    clean_text_html,
+    deduplicate_data,
+    detect_pii,
+    extract_language,
+    tokenise_texts,
+)
+from splitting import hash_split, split_data
+
+# Small vocabularies to draw synthetic sentences from
+VOCABULARIES = {
+    "en": "the quick brown fox jumps over a lazy dog while data pipelines clean "
+    "language model training text and people read about the weather today".split(),
+    "fr": "le chat est sur la table avec une pomme rouge et un livre bleu dans la "
+    "maison pendant que les enfants jouent dans le jardin".split(),
+    "de": "der schnelle braune fuchs springt über den faulen hund und die kinder "
+    "spielen heute im garten mit einem roten ball".split(),
+    "es": "el rápido zorro marrón salta sobre el perro perezoso mientras los niños "
+    "juegan en el jardín con una pelota roja".split(),
+}
+DOMAINS = ["example.com", "news.example.org", "blog.example.net", "github.com"]
+DEFAULT_SCALES = [1_000, 10_000]
+# Relative drop in rows/sec beyond which a stage counts as a regression
+DEFAULT_THRESHOLD = 0.15
+
+
+def generate_corpus(
+    n_rows: int,
+    html_ratio: float = 0.2,
+    url_ratio: float = 0.05,
+    duplicate_rate: float = 0.05,
+    language_mix: dict[str, float] = {"en": 0.8, "fr": 0.1, "de": 0.05, "es": 0.05},
+    pii_density: float = 0.05,
+    min_words: int = 20,
+    max_words: int = 300,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Generate a reproducible corpus of `text` and `url` records. Each ratio is the
+    fraction of rows with HTML markup, dominated by URLs, containing an email
+    address or phone number, or repeating an earlier row.
+    """
+    rng = random.Random(seed)
+    languages, weights = zip(*language_mix.items())
+    rows = []
+    for i in range(n_rows):
+        if i > 0 and rng.random() < duplicate_rate:
+            rows.append(dict(rows[rng.randrange(i)]))
+            continue
+        language = rng.choices(languages, weights)[0]
+        text = " ".join(
+            rng.choices(VOCABULARIES[language], k=rng.randint(min_words, max_words))
+        )
+        if rng.random() < pii_density:
+            text += rng.choice(
+                [
+                    f" contact jane.doe{i}@example.com for details",
+                    f" call +44 20 7946 {i % 10000:04d} today",
+                ]
+            )
+        if rng.random() < url_ratio:
+            text = " ".join(
+                f"https://{rng.choice(DOMAINS)}/page/{rng.randrange(10**6)}"
+                for _ in range(20)
+            )
+        elif rng.random() < html_ratio:
+            text = (
+                f"<html><head><style>p {{ color: red; }}</style></head><body>"
+                f"<p class='x'>{text}</p><script>var a = {i};</script>"
+                f"<a href='https://example.com'>link &amp; more</a></body></html>"
+            )
+        url = f"https://{rng.choice(DOMAINS)}/doc/{i}" if rng.random() < 0.9 else None
+        rows.append({"text": text, "url": url})
+    return pd.DataFrame(rows)
+
+
+def split_stage(data: pd.DataFrame, method: str = "random") -> pd.DataFrame:
+    """Split the data, returning it unchanged so it can be timed like a stage."""
+    if method == "hash":
+        hash_split(data, test_size=0.2, val_size=0.1, random_state=42)
+    else:
+        split_data(data, test_size=0.2, val_size=0.1, random_state=42)
+    return data
+
+
+def benchmark_stages() -> dict[str, Callable[[pd.DataFrame], pd.DataFrame]]:
+    """Return the stages to time, one entry per backend of each stage."""
+    stages = {
+        "deduplicate_data": partial(deduplicate_data, fields=["text"]),
+    }
+    for engine in HtmlEngine:
+        stages[f"clean_text_html[{engine.value}]"] = partial(
+            clean_text_html, engine=engine
+        )
+    stages["check_text_is_code"] = check_text_is_code
+    for tool in LanguageTool:
+        stages[f"extract_language[{tool.value}]"] = partial(extract_language, tool=tool)
+    stages["detect_pii"] = detect_pii
+    for method in ["tiktoken", "nltk", "spacy"]:
+        stages[f"tokenise_texts[{method}]"] = partial(tokenise_texts, method=method)
+    for method in ["random", "hash"]:
+        stages[f"split_data[{method}]"] = partial(split_stage, method=method)
+    return stages
+
+
+def time_stage(
+    func: Callable[[pd.DataFrame], pd.DataFrame], data: pd.DataFrame, repeat: int = 3
+) -> float:
+    """Return the best wall time of `repeat` runs, each on a fresh copy of the data."""
+    timings = []
+    for _ in range(repeat):
+        copy = data.copy()
+        # Stages print their progress, which would drown out the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func(copy)
+            timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_benchmarks(
+    scales: list[int],
+    repeat: int = 3,
+    only: list[str] | None = None,
+    corpus_kwargs: dict = {},
+) -> dict:
+    """
+    Time each stage on corpora of each scale. Stages whose backend is not
+    available, e.g. a missing spaCy model, are recorded with their error.
+    """
+    stages = benchmark_stages()
+    if only is not None:
+        stages = {
+            name: func
+            for name, func in stages.items()
+            if name in only or name.split("[")[0] in only
+        }
+    results: dict[str, dict] = {name: {} for name in stages}
+    for scale in scales:
+        data = generate_corpus(scale, **corpus_kwargs)
+        text_mb = data["text"].str.len().sum() / 1e6
+        print(f"Benchmarking {len(data)} rows ({text_mb:.1f}M characters)")
+        for name, func in stages.items():
+            try:
+                # Warm up lazily loaded models and caches before timing
+                time_stage(func, data.head(10), repeat=1)
+                seconds = time_stage(func, data, repeat)
+            except Exception as e:
+                error = f"{type(e).__name__}: {' '.join(str(e).split())[:200]}"
+                print(f"\t{name}: skipped ({error})")
+                results[name][str(scale)] = {"error": error}
+                continue
+            print(f"\t{name}: {seconds:.3f}s, {scale / seconds:,.0f} rows/sec")
+            results[name][str(scale)] = {
+                "seconds": seconds,
+                "rows_per_s": scale / seconds,
+            }
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "corpus": corpus_kwargs,
+        },
+        "results": results,
+    }
+
+
+def compare_results(
+    results: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD
+) -> list[str]:
+    """
+    Print the change in rows/sec of each stage and scale against the baseline,
+    returning the stages that slowed down by more than `threshold`.
+    """
+    regressions = []
+    print(f"Comparing against baseline from {baseline['meta']['created']}")
+    for name, scales in results["results"].items():
+        for scale, result in scales.items():
+            base = baseline["results"].get(name, {}).get(scale, {})
+            if "rows_per_s" not in result or "rows_per_s" not in base:
+                continue
+            change = result["rows_per_s"] / base["rows_per_s"] - 1
+            flag = ""
+            if change < -threshold:
+                flag = " REGRESSION"
+                regressions.append(f"{name} @ {scale}")
+            print(f"\t{name} @ {scale}: {change:+.1%}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages.")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--stages", nargs="+", default=None, help="Only time these stages"
+    )
+    parser.add_argument("--output", default="output/benchmark.json")
+    parser.add_argument(
+        "--baseline", default=None, help="Benchmark JSON to flag regressions against"
+    )
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument(
+        "--generate",
+        default=None,
+        help="Only write a synthetic JSONL corpus of the first scale to this path",
+    )
+    parser.add_argument("--html-ratio", type=float, default=0.2)
+    parser.add_argument("--url-ratio", type=float, default=0.05)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05)
+    parser.add_argument("--pii-density", type=float, default=0.05)
+    parser.add_argument(
+        "--language-mix",
+        type=json.loads,
+        default={"en": 0.8, "fr": 0.1, "de": 0.05, "es": 0.05},
+        help='Language weights as JSON, e.g. \'{"en": 0.9, "fr": 0.1}\'',
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus_kwargs = {
+        "html_ratio": args.html_ratio,
+        "url_ratio": args.url_ratio,
+        "duplicate_rate": args.duplicate_rate,
+        "language_mix": args.language_mix,
+        "pii_density": args.pii_density,
+        "seed": args.seed,
+    }
+    if args.generate is not None:
+        corpus = generate_corpus(args.scales[0], **corpus_kwargs)
+        corpus.to_json(args.generate, lines=True, orient="records")
+        print(f"Saved {len(corpus)} synthetic records to {args.generate}")
+        sys.exit(0)
+
+    results = run_benchmarks(args.scales, args.repeat, args.stages, corpus_kwargs)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=4)
+    print(f"Saved benchmark results to {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        regressions = compare_results(results, baseline, args.threshold)
+        if len(regressions) > 0:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions")
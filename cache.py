@@ -0,0 +1,169 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+# Keys per SQL statement, kept below SQLite's bound parameter limit
+LOOKUP_BATCH_SIZE = 500
+
+
+def _to_builtin(value):
+    """Convert NumPy scalars to Python values for JSON encoding."""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot cache value of type {type(value).__name__}")
+
+
+class ResultCache:
+    """
+    On-disk cache of per-row stage results. Rows are keyed by a hash of the text,
+    the stage name and the stage parameters, and the least recently used entries
+    are evicted once the cache holds more than `max_entries` rows.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10_000_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        # Chunks can be processed on several threads, which share the connection
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)"
+        )
+        # Upper bound on the number of rows, since replaced keys are counted
+        # again; the table is only counted once this exceeds `max_entries`
+        (self.n_entries,) = self.connection.execute(
+            "SELECT COUNT(*) FROM results"
+        ).fetchone()
+
+    def make_keys(self, texts: pd.Series, stage: str, params: dict) -> pd.Series:
+        """Hash each text together with the stage name and parameters."""
+        prefix = hashlib.blake2b(
+            json.dumps([stage, params], sort_keys=True).encode(), digest_size=16
+        )
+        keys = []
+        for text in texts:
+            digest = prefix.copy()
+            digest.update(str(text).encode("utf-8", "surrogatepass"))
+            keys.append(digest.hexdigest())
+        return pd.Series(keys, index=texts.index)
+
+    def get(self, keys: list[str]) -> dict[str, list]:
+        """Look up cached values, marking the found entries as recently used."""
+        with self.lock:
+            return self._get(keys)
+
+    def _get(self, keys: list[str]) -> dict[str, list]:
+        found = {}
+        for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            batch = keys[start : start + LOOKUP_BATCH_SIZE]
+            rows = self.connection.execute(
+                "SELECT key, value FROM results WHERE key IN "
+                f"({', '.join('?' * len(batch))})",
+                batch,
+            )
+            found.update((key, json.loads(value)) for key, value in rows)
+        now = time.time_ns()
+        self.connection.executemany(
+            "UPDATE results SET last_used = ? WHERE key = ?",
+            ((now, key) for key in found),
+        )
+        self.connection.commit()
+        return found
+
+    def put(self, values: dict[str, list]) -> None:
+        """Store values, then evict the least recently used entries over the bound."""
+        with self.lock:
+            self._put(values)
+
+    def _put(self, values: dict[str, list]) -> None:
+        now = time.time_ns()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO results (key, value, last_used) VALUES (?, ?, ?)",
+            (
+                (key, json.dumps(value, default=_to_builtin), now)
+                for key, value in values.items()
+            ),
+        )
+        self.n_entries += len(values)
+        if self.n_entries > self.max_entries:
+            (self.n_entries,) = self.connection.execute(
+                "SELECT COUNT(*) FROM results"
+            ).fetchone()
+        if self.n_entries > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY last_used LIMIT ?)",
+                (self.n_entries - self.max_entries,),
+            )
+            self.n_entries = self.max_entries
+        self.connection.commit()
+
+    def apply(
+        self,
+        texts: pd.Series,
+        stage: str,
+        params: dict,
+        compute: Callable[[pd.Series], pd.DataFrame],
+        columns: list[str],
+    ) -> pd.DataFrame:
+        """
+        Return `compute(texts)[columns]`, only computing rows whose text has not
+        been seen before by this stage with these parameters.
+        """
+        keys = self.make_keys(texts, stage, params)
+        found = self.get(keys.unique().tolist())
+        is_hit = keys.isin(found.keys())
+        with self.lock:
+            self.hits[stage] += int(is_hit.sum())
+            self.misses[stage] += int((~is_hit).sum())
+
+        missing = ~is_hit & ~keys.duplicated()
+        if missing.any():
+            computed = compute(texts[missing])[columns]
+            new_values = dict(
+                zip(keys[missing], computed.to_numpy(dtype=object).tolist())
+            )
+            self.put(new_values)
+            found.update(new_values)
+        return pd.DataFrame(
+            [found[key] for key in keys], index=texts.index, columns=columns
+        )
+
+    def print_stats(self) -> None:
+        """Print the hit and miss counts of each stage."""
+        print(f"Result cache statistics ({self.path}):")
+        for stage in sorted(set(self.hits) | set(self.misses)):
+            hits, misses = self.hits[stage], self.misses[stage]
+            rate = hits / (hits + misses) if hits + misses > 0 else 0.0
+            print(f"\t{stage}: {hits} hits, {misses} misses ({rate:.1%} hit rate)")
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def cached_apply(
+    cache: ResultCache | None,
+    texts: pd.Series,
+    stage: str,
+    params: dict,
+    compute: Callable[[pd.Series], pd.DataFrame],
+    columns: list[str],
+) -> pd.DataFrame:
+    """Run `compute` over the texts, going through `cache` when one is given."""
+    if cache is None:
+        return compute(texts)[columns]
+    return cache.apply(texts, stage, params, compute, columns)
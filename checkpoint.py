@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from dataio import expand_paths
+from dedup_index import DedupIndex
+
+# Bytes hashed from each end of the input file for its fingerprint
+FINGERPRINT_SAMPLE_BYTES = 1 << 20
+# Config keys that do not change the pipeline's results
+RUNTIME_KEYS = ("n_workers", "read_workers", "cache", "profile_stage", "checkpoint")
+
+
+def config_hash(config: dict) -> str:
+    """Hash the config, ignoring keys that only affect how the run executes."""
+    config = {k: v for k, v in config.items() if k not in RUNTIME_KEYS}
+    return hashlib.blake2b(
+        json.dumps(config, sort_keys=True).encode(), digest_size=16
+    ).hexdigest()
+
+
+def input_fingerprint(paths: list[str]) -> str:
+    """
+    Fingerprint the input files from their paths, sizes, modification times and
+    the bytes at their start and end, without reading the whole files.
+    """
+    digest = hashlib.blake2b()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        with open(path, "rb") as file:
+            digest.update(file.read(FINGERPRINT_SAMPLE_BYTES))
+            file.seek(max(stat.st_size - FINGERPRINT_SAMPLE_BYTES, 0))
+            digest.update(file.read(FINGERPRINT_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def run_key(config: dict) -> str:
+    """
+    Identify a job by its config, ignoring the dedup index settings, and its
+    input files, so that the dedup index can tell its own earlier runs apart.
+    """
+    config = {k: v for k, v in config.items() if k != "dedup_index"}
+    key = f"{config_hash(config)}:{input_fingerprint(expand_paths(config['filename']))}"
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+class Checkpoint:
+    """
+    On-disk record of a run's progress, kept in `directory`. Whole-file runs save
+    the DataFrame after every stage; streaming runs record each completed chunk
+    and the state of the output files. The manifest is keyed by the config hash
+    and input fingerprint, so a changed config or input starts a fresh run.
+    The state of the `dedup_index`, once set, and the domain quota counts are
+    recorded alongside.
+    """
+
+    def __init__(self, directory: str, config: dict, resume: bool = False):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        key = {
+            "config_hash": config_hash(config),
+            "input_fingerprint": input_fingerprint(expand_paths(config["filename"])),
+        }
+        manifest = None
+        if resume and os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as file:
+                manifest = json.load(file)
+            if {k: manifest.get(k) for k in key} != key:
+                print("\tConfig or input changed since the checkpoint, starting over")
+                manifest = None
+        elif resume:
+            print(f"\tNo checkpoint found in {directory}, starting over")
+        if manifest is None:
+            shutil.rmtree(directory, ignore_errors=True)
+            manifest = {
+                **key,
+                "stages": [],
+                "chunks": 0,
+                "writers": {},
+                "rows": [0, 0],
+                "dedup_index": None,
+                "domain_quota": None,
+            }
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = manifest
+        self.resumed = len(manifest["stages"]) > 0 or manifest["chunks"] > 0
+        self.dedup_index: DedupIndex | None = None
+
+    @property
+    def dedup_path(self) -> str:
+        """Where an index that would otherwise live in memory is kept instead."""
+        return os.path.join(self.directory, "dedup_index")
+
+    def save_dedup_state(self, state: dict | None) -> None:
+        """Save the manifest with the dedup index `state`, then drop older ones."""
+        self.manifest["dedup_index"] = state
+        self.save_manifest()
+        if state is not None:
+            self.dedup_index.release(state)
+
+    def save_manifest(self) -> None:
+        """Replace the manifest atomically, so a crash never leaves it half-written."""
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.manifest, file, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def stage_path(self, position: int, name: str) -> str:
+        return os.path.join(self.directory, f"stage_{position:02d}_{name}.pkl")
+
+    def restore_stages(self, names: list[str]) -> tuple[int, pd.DataFrame | None]:
+        """
+        Return how many of the planned stages have completed and the DataFrame
+        saved after the last of them, or `(0, None)` if none have.
+        """
+        completed = self.manifest["stages"]
+        if len(completed) == 0 or completed != names[: len(completed)]:
+            return 0, None
+        position = len(completed) - 1
+        print(f"\tResuming after stage {completed[-1]}")
+        return len(completed), pd.read_pickle(self.stage_path(position, completed[-1]))
+
+    def save_stage(self, name: str, data: pd.DataFrame) -> None:
+        """Save the DataFrame after a stage, replacing the previous stage's."""
+        position = len(self.manifest["stages"])
+        data.to_pickle(self.stage_path(position, name))
+        self.manifest["stages"].append(name)
+        self.save_dedup_state(
+            self.dedup_index.state() if self.dedup_index is not None else None
+        )
+        if position > 0:
+            os.remove(self.stage_path(position - 1, self.manifest["stages"][-2]))
+
+    @property
+    def chunks_completed(self) -> int:
+        return self.manifest["chunks"]
+
+    def save_chunk(
+        self,
+        writer_states: dict[str, dict],
+        rows: tuple[int, int],
+        dedup_state: dict | None = None,
+        quota_counts: np.ndarray | None = None,
+    ) -> None:
+        """
+        Record that another chunk has been written, with the state of each output
+        writer, the total rows read and written so far, and the state of the
+        dedup index and the domain quota counts as of the chunk.
+        """
+        previous_quota = self.manifest["domain_quota"]
+        if quota_counts is not None:
+            # Counts are kept out of the manifest, as there is one per domain
+            name = f"domain_quota_{self.manifest['chunks']:06d}.npy"
+            np.save(os.path.join(self.directory, name), quota_counts)
+            self.manifest["domain_quota"] = name
+        self.manifest["chunks"] += 1
+        self.manifest["writers"] = writer_states
+        self.manifest["rows"] = list(rows)
+        self.save_dedup_state(dedup_state)
+        if previous_quota not in (None, self.manifest["domain_quota"]):
+            os.remove(os.path.join(self.directory, previous_quota))
+
+    def domain_quota_counts(self) -> np.ndarray | None:
+        """Return the domain quota counts as of the last completed chunk."""
+        if self.manifest["domain_quota"] is None:
+            return None
+        return np.load(os.path.join(self.directory, self.manifest["domain_quota"]))
+
+    def chunk_outputs_path(self, chunk: int) -> str:
+        return os.path.join(self.directory, f"chunk_{chunk:06d}.pkl")
+
+    def remove(self) -> None:
+        """Delete the checkpoint once the run has finished."""
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,91 @@
+import re
+from functools import partial
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+import backends
+
+# Characters much more common in source code than in prose
+CODE_SYMBOLS = "{}[]()<>=;*&|$#\\/_^~`"
+DELETE_CODE_SYMBOLS = str.maketrans("", "", CODE_SYMBOLS)
+INDENTED_LINE_RE = re.compile(r"^(?: {2,}|\t)\S", re.MULTILINE)
+# Lines ending the way statements and blocks do
+CODE_LINE_END_RE = re.compile(r"[;{}(),:\[]\s*$", re.MULTILINE)
+# Keywords and operators that rarely appear in prose
+CODE_TOKEN_RE = re.compile(
+    r"\b(?:def|elif|import|return|function|const|var|let|void|public|private|"
+    r"static|struct|namespace|printf|println|console|self|this|null|None|true|"
+    r"false|nil|fn|func|async|await)\b|#include|==|!=|&&|\|\||::|->|=>|\+\+|\+="
+)
+# Weights of the symbol density, indentation, line ending and keyword features
+FEATURE_WEIGHTS = np.array([0.35, 0.2, 0.2, 0.25])
+# Symbol density and keywords per line at which those features saturate
+SYMBOL_DENSITY_SCALE = 0.08
+TOKENS_PER_LINE_SCALE = 1.0
+
+
+def code_features(text: str) -> tuple[float, float, float, float]:
+    """
+    Score a text's symbol density, share of indented lines, share of lines
+    ending like statements and keyword hits per line, each between 0 and 1.
+    """
+    if len(text) == 0:
+        return 0.0, 0.0, 0.0, 0.0
+    lines = text.count("\n") + 1
+    symbols = len(text) - len(text.translate(DELETE_CODE_SYMBOLS))
+    return (
+        min(symbols / len(text) / SYMBOL_DENSITY_SCALE, 1.0),
+        len(INDENTED_LINE_RE.findall(text)) / lines,
+        len(CODE_LINE_END_RE.findall(text)) / lines,
+        min(len(CODE_TOKEN_RE.findall(text)) / lines / TOKENS_PER_LINE_SCALE, 1.0),
+    )
+
+
+def code_scores(texts: pd.Series) -> pd.Series:
+    """Score how much each text looks like source code, from 0 (prose) to 1."""
+    if len(texts) == 0:
+        return pd.Series(dtype=np.float64, index=texts.index)
+    features = np.array([code_features(text) for text in texts], dtype=np.float64)
+    return pd.Series(features @ FEATURE_WEIGHTS, index=texts.index)
+
+
+def lexer_is_code(texts: pd.Series, prefix_chars: int = 2000) -> pd.Series:
+    """Check whether pygments guesses a lexer other than plain text for each prefix."""
+    guess_lexer = backends.load("pygments.lexers").guess_lexer
+    class_not_found = backends.load("pygments.util").ClassNotFound
+    is_code = []
+    for text in texts:
+        try:
+            is_code.append(guess_lexer(text[:prefix_chars]).name != "Text only")
+        except class_not_found:
+            is_code.append(False)
+    return pd.Series(is_code, index=texts.index, dtype=bool)
+
+
+def detect_code(
+    texts: pd.Series,
+    threshold: float = 0.4,
+    margin: float = 0.1,
+    prefix_chars: int = 2000,
+    map_func: Callable | None = None,
+) -> pd.DataFrame:
+    """
+    Flag texts whose code score reaches `threshold`. Texts scoring within
+    `margin` of the threshold are decided by pygments' `guess_lexer` on their
+    first `prefix_chars` characters instead. `map_func(series, func)` runs a
+    `Series -> Series` function, e.g. over a process pool.
+    """
+    map_func = map_func or (lambda series, func: func(series))
+    scores = map_func(texts, code_scores)
+    is_code = scores >= threshold
+    # Bounds compared directly, as abs(score - threshold) rounds 0.5 - 0.4 below 0.1
+    ambiguous = (scores > threshold - margin) & (scores < threshold + margin)
+    if ambiguous.any():
+        print(f"\t{ambiguous.sum()} ambiguous texts checked with guess_lexer")
+        # Shuffled inputs have a non-monotonic index, so assign by position
+        is_code.loc[ambiguous] = map_func(
+            texts[ambiguous], partial(lexer_is_code, prefix_chars=prefix_chars)
+        ).to_numpy(dtype=bool)
+    return pd.DataFrame({"is_code": is_code, "code_score": scores})
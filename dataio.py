@@ -0,0 +1,528 @@
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.json as pj
+import pyarrow.parquet as pq
+
+FORMATS = ["jsonl", "parquet", "arrow"]
+EXTENSIONS = {
+    ".jsonl": "jsonl",
+    ".json": "jsonl",
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".ipc": "arrow",
+}
+# Compressed JSONL inputs, decompressed by Arrow while reading
+COMPRESSIONS = {
+    ".gz": "gzip",
+    ".zst": "zstd",
+    ".zstd": "zstd",
+    ".bz2": "bz2",
+    ".lz4": "lz4",
+}
+# Types of the fields the pipeline reads. When only these are requested, Arrow's
+# JSON parser skips the other fields of each record.
+JSONL_FIELD_TYPES = {"text": pa.string(), "url": pa.string()}
+# Bytes of JSONL parsed per Arrow block
+JSONL_BLOCK_SIZE = 1 << 24
+
+
+def split_compression(path: str) -> tuple[str, str | None]:
+    """Split a compression extension off `path`, returning the compression used."""
+    root, extension = os.path.splitext(path)
+    if extension.lower() in COMPRESSIONS:
+        return root, COMPRESSIONS[extension.lower()]
+    return path, None
+
+
+def expand_paths(filename: str | list[str]) -> list[str]:
+    """Expand a path, glob or list of paths and globs into a list of input files."""
+    patterns = [filename] if isinstance(filename, str) else filename
+    paths = []
+    for pattern in patterns:
+        if any(char in pattern for char in "*?["):
+            matches = sorted(glob.glob(pattern))
+            assert len(matches) > 0, f"No input files match '{pattern}'"
+            paths.extend(matches)
+        else:
+            paths.append(pattern)
+    return paths
+
+
+def infer_format(path: str, file_format: str | None = None) -> str:
+    """Return the given format, or infer it from the file extension."""
+    root, compression = split_compression(path)
+    if file_format is None:
+        file_format = EXTENSIONS.get(os.path.splitext(root)[1].lower(), "jsonl")
+    assert file_format in FORMATS, (
+        f"Invalid file format '{file_format}', choose from {FORMATS}"
+    )
+    assert compression is None or file_format == "jsonl", (
+        f"Only JSONL inputs can be compressed, got {path}"
+    )
+    return file_format
+
+
+def with_extension(path: str, file_format: str) -> str:
+    """Swap the extension of `path` for the default extension of `file_format`."""
+    return f"{os.path.splitext(path)[0]}.{file_format}"
+
+
+def project(data: pd.DataFrame, columns: list[str] | None) -> pd.DataFrame:
+    if columns is None:
+        return data
+    return data[[column for column in columns if column in data.columns]]
+
+
+def available_columns(columns: list[str] | None, names: list[str]) -> list[str]:
+    """Return the requested columns that exist, or all columns if none are requested."""
+    if columns is None:
+        return names
+    return [column for column in columns if column in names]
+
+
+def jsonl_parse_options(columns: list[str] | None) -> pj.ParseOptions:
+    """Parse only the requested fields when their types are known."""
+    if columns is None or not all(c in JSONL_FIELD_TYPES for c in columns):
+        return pj.ParseOptions()
+    return pj.ParseOptions(
+        explicit_schema=pa.schema((c, JSONL_FIELD_TYPES[c]) for c in columns),
+        unexpected_field_behavior="ignore",
+    )
+
+
+def strings_for_timestamps(data_type: pa.DataType) -> pa.DataType:
+    """Swap timestamp types, including those nested in structs and lists, for strings."""
+    if pa.types.is_timestamp(data_type):
+        return pa.string()
+    if pa.types.is_struct(data_type):
+        return pa.struct(
+            [field.with_type(strings_for_timestamps(field.type)) for field in data_type]
+        )
+    if pa.types.is_list(data_type):
+        value_field = data_type.value_field
+        return pa.list_(value_field.with_type(strings_for_timestamps(value_field.type)))
+    return data_type
+
+
+def timestamps_as_strings(schema: pa.Schema) -> pj.ParseOptions | None:
+    """
+    Arrow infers ISO date strings as timestamps, which would rewrite fields the
+    pipeline only passes through. Return parse options reading the fields
+    inferred that way as strings, or None if there are none.
+    """
+    fields = [
+        field.with_type(strings_for_timestamps(field.type))
+        for field in schema
+        if strings_for_timestamps(field.type) != field.type
+    ]
+    if len(fields) == 0:
+        return None
+    return pj.ParseOptions(
+        explicit_schema=pa.schema(fields), unexpected_field_behavior="infer"
+    )
+
+
+def empty_jsonl_table(columns: list[str] | None) -> pa.Table:
+    return pa.schema(
+        (c, JSONL_FIELD_TYPES.get(c, pa.null())) for c in columns or []
+    ).empty_table()
+
+
+def select_columns(table: pa.Table, columns: list[str] | None) -> pa.Table:
+    return table.select(available_columns(columns, table.column_names))
+
+
+def read_arrow_file(
+    path: str,
+    file_format: str | None = None,
+    columns: list[str] | None = None,
+    nrows: int | None = None,
+) -> pa.Table:
+    """Read the `columns` of a single file into an Arrow table."""
+    file_format = infer_format(path, file_format)
+    if nrows is not None:
+        # Stop reading once enough rows have been read
+        batches, rows = [], 0
+        for batch in read_file_batches(path, nrows, file_format, columns):
+            batches.append(batch)
+            rows += len(batch)
+            if rows >= nrows:
+                break
+        if len(batches) > 0:
+            return pa.Table.from_batches(batches).slice(0, nrows)
+        if file_format == "jsonl":
+            return empty_jsonl_table(columns)
+        return read_arrow_file(path, file_format, columns)
+    if file_format == "parquet":
+        names = pq.read_schema(path).names
+        return pq.read_table(path, columns=available_columns(columns, names))
+    if file_format == "arrow":
+        with pa.memory_map(path) as source:
+            return select_columns(ipc.open_file(source).read_all(), columns)
+    try:
+        table = read_jsonl_table(path, jsonl_parse_options(columns))
+    except pa.ArrowInvalid as e:
+        if not str(e).startswith("Empty JSON"):
+            raise
+        return empty_jsonl_table(columns)
+    parse_options = timestamps_as_strings(table.schema)
+    if parse_options is not None:
+        table = read_jsonl_table(path, parse_options)
+    return select_columns(table, columns)
+
+
+def read_jsonl_table(path: str, parse_options: pj.ParseOptions) -> pa.Table:
+    with pa.input_stream(path, compression=split_compression(path)[1]) as source:
+        return pj.read_json(
+            source,
+            read_options=pj.ReadOptions(block_size=JSONL_BLOCK_SIZE),
+            parse_options=parse_options,
+        )
+
+
+def log_pandas_fallback(path: str, error: Exception) -> None:
+    print(
+        f"	{path}: Arrow could not read the file ({error}), reading it with pandas"
+    )
+
+
+def read_file(
+    path: str,
+    file_format: str | None = None,
+    columns: list[str] | None = None,
+    nrows: int | None = None,
+) -> pd.DataFrame:
+    """
+    Read the `columns` of a single file into a DataFrame. JSONL files whose
+    fields change type between records, which Arrow cannot represent, are read
+    with pandas instead.
+    """
+    try:
+        return read_arrow_file(path, file_format, columns, nrows).to_pandas()
+    except pa.ArrowInvalid as e:
+        if infer_format(path, file_format) != "jsonl":
+            raise
+        log_pandas_fallback(path, e)
+        return project(
+            pd.read_json(path, lines=True, nrows=nrows, convert_dates=False), columns
+        )
+
+
+def read_file_batches(
+    path: str,
+    batch_size: int,
+    file_format: str | None = None,
+    columns: list[str] | None = None,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Lazily read the `columns` of a single file in record batches. Parquet and
+    Arrow batches hold at most `batch_size` rows; JSONL batches cover one block
+    of input.
+    """
+    file_format = infer_format(path, file_format)
+    if file_format == "parquet":
+        parquet_file = pq.ParquetFile(path)
+        yield from parquet_file.iter_batches(
+            batch_size=batch_size,
+            columns=available_columns(columns, parquet_file.schema_arrow.names),
+        )
+        return
+    if file_format == "arrow":
+        with pa.memory_map(path) as source:
+            table = select_columns(ipc.open_file(source).read_all(), columns)
+            yield from table.to_batches(max_chunksize=batch_size)
+        return
+    parse_options = jsonl_parse_options(columns)
+    with pa.input_stream(path, compression=split_compression(path)[1]) as source:
+        try:
+            reader = open_jsonl(source, parse_options)
+        except pa.ArrowInvalid as e:
+            if not str(e).startswith("Empty JSON"):
+                raise
+            return
+        # The schema comes from the first block, so timestamps show before any batch
+        string_options = timestamps_as_strings(reader.schema)
+        if string_options is None:
+            for batch in reader:
+                yield batch.select(available_columns(columns, batch.schema.names))
+            return
+    with pa.input_stream(path, compression=split_compression(path)[1]) as source:
+        for batch in open_jsonl(source, string_options):
+            yield batch.select(available_columns(columns, batch.schema.names))
+
+
+def open_jsonl(source: pa.NativeFile, parse_options: pj.ParseOptions):
+    return pj.open_json(
+        source,
+        read_options=pj.ReadOptions(block_size=JSONL_BLOCK_SIZE),
+        parse_options=parse_options,
+    )
+
+
+def read_file_frames(
+    path: str,
+    batch_size: int,
+    file_format: str | None = None,
+    columns: list[str] | None = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Lazily read the `columns` of a single file in DataFrames, as laid out by
+    `read_file_batches`. A JSONL file whose fields change type between records
+    is read on with pandas from the first record Arrow could not convert.
+    """
+    rows = 0
+    try:
+        for batch in read_file_batches(path, batch_size, file_format, columns):
+            rows += len(batch)
+            yield batch.to_pandas()
+    except pa.ArrowInvalid as e:
+        if infer_format(path, file_format) != "jsonl":
+            raise
+        log_pandas_fallback(path, e)
+        with pd.read_json(
+            path, lines=True, chunksize=batch_size, convert_dates=False
+        ) as reader:
+            for chunk in reader:
+                chunk = chunk.iloc[max(rows - chunk.index[0], 0) :]
+                if len(chunk) > 0:
+                    yield project(chunk, columns).reset_index(drop=True)
+
+
+def log_file_read(path: str, rows: int, seconds: float) -> None:
+    """Print the rows read from a file and its read throughput."""
+    mb = os.path.getsize(path) / 1e6
+    print(
+        f"\t{path}: {rows} rows, {mb:.1f} MB in {seconds:.2f}s "
+        f"({mb / max(seconds, 1e-9):.1f} MB/s)"
+    )
+
+
+def log_file_read_total(paths: list[str], rows: int, seconds: float) -> None:
+    mb = sum(os.path.getsize(path) for path in paths) / 1e6
+    print(
+        f"\tRead {rows} rows from {len(paths)} files, {mb:.1f} MB in {seconds:.2f}s "
+        f"({mb / max(seconds, 1e-9):.1f} MB/s)"
+    )
+
+
+def concat_frames(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate DataFrames, filling columns missing from some files with nulls."""
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    # Empty frames would turn the columns they lack into all-null object columns
+    frames = [frame for frame in frames if len(frame) > 0] or frames[:1]
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_table(
+    path: str | list[str],
+    file_format: str | None = None,
+    columns: list[str] | None = None,
+    nrows: int | None = None,
+    workers: int | None = None,
+) -> pd.DataFrame:
+    """
+    Read one or more JSONL, Parquet or Arrow IPC files into a DataFrame. `path`
+    can be a path, a glob or a list of them; JSONL files can be compressed.
+    Only the requested `columns` are decoded, and files are read in parallel
+    by `workers` threads (one per file, up to the number of CPUs, by default).
+    """
+    paths = expand_paths(path)
+    workers = workers or min(len(paths), os.cpu_count() or 1)
+
+    def read(file_path: str) -> pd.DataFrame:
+        start = time.perf_counter()
+        frame = read_file(file_path, file_format, columns, nrows)
+        log_file_read(file_path, len(frame), time.perf_counter() - start)
+        return frame
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        frames = list(executor.map(read, paths))
+    data = concat_frames(frames)
+    if nrows is not None:
+        data = data.iloc[:nrows]
+    if len(paths) > 1:
+        log_file_read_total(paths, len(data), time.perf_counter() - start)
+    return data
+
+
+def read_table_chunks(
+    path: str | list[str],
+    chunksize: int,
+    file_format: str | None = None,
+    columns: list[str] | None = None,
+    nrows: int | None = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Lazily read one or more files in DataFrames of `chunksize` rows (the last
+    may be shorter). Chunks run across file boundaries, so they are the same
+    however the input is sharded.
+    """
+    pending: list[pd.DataFrame] = []
+    pending_rows, rows_read = 0, 0
+
+    def take(n_rows: int) -> pd.DataFrame:
+        nonlocal pending, pending_rows, rows_read
+        data = concat_frames(pending)
+        chunk = data.iloc[:n_rows].copy()
+        pending = [data.iloc[n_rows:]] if n_rows < len(data) else []
+        pending_rows -= len(chunk)
+        chunk.index = pd.RangeIndex(rows_read, rows_read + len(chunk))
+        rows_read += len(chunk)
+        return chunk
+
+    limit = nrows
+    for file_path in expand_paths(path):
+        if limit is not None and limit <= 0:
+            break
+        file_rows, seconds = 0, 0.0
+        frames = read_file_frames(file_path, chunksize, file_format, columns)
+        while True:
+            # Only time reading, not processing the chunks yielded in between
+            start = time.perf_counter()
+            frame = next(frames, None)
+            seconds += time.perf_counter() - start
+            if frame is None:
+                break
+            if limit is not None:
+                frame = frame.iloc[:limit]
+                limit -= len(frame)
+                if len(frame) == 0:
+                    break
+            file_rows += len(frame)
+            pending.append(frame)
+            pending_rows += len(frame)
+            while pending_rows >= chunksize:
+                yield take(chunksize)
+        log_file_read(file_path, file_rows, seconds)
+    if pending_rows > 0:
+        yield take(pending_rows)
+
+
+def read_jsonl_fields(
+    path: str, schema: pa.Schema, block_size: int = 1 << 24
+) -> Iterator[pd.DataFrame]:
+    """
+    Lazily read the `schema` fields of a JSONL file, in DataFrames covering about
+    `block_size` bytes of input. Other fields are skipped by Arrow's parser
+    without being converted to Python objects; missing fields are null.
+    """
+    with pa.input_stream(path, compression=split_compression(path)[1]) as source:
+        reader = pj.open_json(
+            source,
+            read_options=pj.ReadOptions(block_size=block_size),
+            parse_options=pj.ParseOptions(
+                explicit_schema=schema, unexpected_field_behavior="ignore"
+            ),
+        )
+        for batch in reader:
+            yield batch.to_pandas()
+
+
+def to_arrow(data: pd.DataFrame) -> pa.Table:
+    """Convert a DataFrame to Arrow, storing columns of Python objects as strings."""
+    data = data.copy(deep=False)
+    for column in data.columns[data.dtypes == object]:
+        values = data[column].dropna()
+        if len(values) > 0 and not values.map(type).isin([str, bytes]).all():
+            data[column] = data[column].map(lambda x: str(x) if x is not None else x)
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    # Categoricals get the narrowest index type for their number of categories,
+    # which can differ between chunks, so widen them to a fixed type
+    return table.cast(
+        pa.schema(
+            field.with_type(pa.dictionary(pa.int32(), pa.string()))
+            if pa.types.is_dictionary(field.type)
+            else field
+            for field in table.schema
+        )
+    )
+
+
+class TableWriter:
+    """
+    Append DataFrames to a JSONL, Parquet or Arrow IPC file. Parquet and Arrow
+    files keep the schema of the first DataFrame written. A JSONL writer given
+    the `state()` of an earlier writer truncates the file back to that state and
+    appends to it.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        file_format: str | None = None,
+        compression: str | None = None,
+        columns: list[str] | None = None,
+        resume_state: dict | None = None,
+    ):
+        self.path = path
+        self.file_format = infer_format(path, file_format)
+        self.compression = compression
+        self.columns = columns
+        self.rows_written = 0
+        self._writer = None
+        self._schema = None
+        if self.file_format == "jsonl" and resume_state is not None:
+            # Drop anything appended after the state was recorded
+            with open(path, "r+") as file:
+                file.truncate(resume_state["bytes"])
+            self.rows_written = resume_state["rows_written"]
+        elif self.file_format == "jsonl":
+            open(path, "w").close()
+
+    @property
+    def resumable(self) -> bool:
+        """Whether the writer can reopen a partly written file and append to it."""
+        return self.file_format == "jsonl"
+
+    def state(self) -> dict:
+        """Return what is needed to resume writing after the rows written so far."""
+        state = {"rows_written": self.rows_written}
+        if self.resumable:
+            state["bytes"] = os.path.getsize(self.path)
+        return state
+
+    def write(self, data: pd.DataFrame) -> None:
+        data = project(data, self.columns)
+        if self.file_format == "jsonl":
+            if len(data) > 0:
+                data.to_json(self.path, lines=True, orient="records", mode="a")
+            self.rows_written += len(data)
+            return
+
+        table = to_arrow(data)
+        if self._writer is None:
+            # Columns that are entirely null in the first chunk are stored as strings
+            self._schema = pa.schema(
+                field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                for field in table.schema
+            )
+            if self.file_format == "parquet":
+                self._writer = pq.ParquetWriter(
+                    self.path, self._schema, compression=self.compression or "none"
+                )
+            else:
+                self._writer = ipc.new_file(
+                    self.path,
+                    self._schema,
+                    options=ipc.IpcWriteOptions(compression=self.compression),
+                )
+        if not table.schema.equals(self._schema):
+            table = table.select(self._schema.names).cast(self._schema)
+        self._writer.write_table(table)
+        self.rows_written += len(data)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        elif self.file_format != "jsonl":
+            print(f"\tNo rows written to {self.path}")
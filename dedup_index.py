@@ -0,0 +1,244 @@
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+DIGEST_DTYPES = {
+    64: np.dtype("<u8"),
+    128: np.dtype([("hi", "<u8"), ("lo", "<u8")]),
+}
+# Separates fields in the hashed bytes, so ("ab", "c") and ("a", "bc") differ
+FIELD_SEPARATOR = b"\x1f"
+
+
+def hash_rows(
+    data: pd.DataFrame, fields: list[str], digest_bits: int = 64
+) -> np.ndarray:
+    """Hash the `fields` of each row into a 64- or 128-bit digest."""
+    digest_size = digest_bits // 8
+    rows = zip(*(data[field].tolist() for field in fields))
+    digests = b"".join(
+        hashlib.blake2b(
+            FIELD_SEPARATOR.join(
+                str(value).encode("utf-8", "surrogatepass") for value in row
+            ),
+            digest_size=digest_size,
+        ).digest()
+        for row in rows
+    )
+    return np.frombuffer(digests, dtype=DIGEST_DTYPES[digest_bits]).copy()
+
+
+def contains_sorted(sorted_digests: np.ndarray, digests: np.ndarray) -> np.ndarray:
+    """Check which digests are in a sorted array of digests."""
+    if len(sorted_digests) == 0:
+        return np.zeros(len(digests), dtype=bool)
+    positions = np.searchsorted(sorted_digests, digests)
+    positions = np.minimum(positions, len(sorted_digests) - 1)
+    return sorted_digests[positions] == digests
+
+
+def snapshot_number(path: str) -> int:
+    """Return the sequence number of a `buffer_NNNNNN.npy` snapshot."""
+    return int(os.path.basename(path)[7:13])
+
+
+class DedupIndex:
+    """
+    Set of row digests used to find exact duplicates across chunks, runs and
+    input files. New digests are buffered in memory and spilled to sorted,
+    memory-mapped `.npy` segments in `path` once the buffer holds
+    `max_memory_entries`, so memory use stays bounded however many rows are
+    indexed. Without a `path` the index lives in memory only. Rows are also
+    checked against the read-only indexes at the `references` paths, e.g. the
+    indexes of previously published datasets.
+
+    Segments are tagged with the `run` that wrote them, so running the same job
+    again replaces its own digests rather than flagging every row as a
+    duplicate of itself. An index given the `state()` of an earlier one rolls
+    back to it, dropping segments written since and restoring the buffer.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        digest_bits: int = 64,
+        max_memory_entries: int = 1_000_000,
+        read_only: bool = False,
+        references: list[str] = [],
+        run: str | None = None,
+        resume_state: dict | None = None,
+    ):
+        assert digest_bits in DIGEST_DTYPES, (
+            f"Invalid digest size {digest_bits}, choose from {list(DIGEST_DTYPES)}"
+        )
+        self.path = path
+        self.digest_bits = digest_bits
+        self.dtype = DIGEST_DTYPES[digest_bits]
+        self.max_memory_entries = max_memory_entries
+        self.read_only = read_only
+        self.run = run
+        self.buffer = np.empty(0, dtype=self.dtype)
+        self.segment_names: list[str] = []
+        self.segments: list[np.ndarray] = []
+        self.segment_runs: dict[str, str | None] = {}
+        self.next_segment = 0
+        self.next_snapshot = 0
+        self.references = [
+            DedupIndex(reference, digest_bits, read_only=True)
+            for reference in references
+        ]
+        if path is not None and os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as file:
+                manifest = json.load(file)
+            assert manifest["digest_bits"] == digest_bits, (
+                f"Index at {path} holds {manifest['digest_bits']}-bit digests"
+            )
+            self.next_segment = manifest["next_segment"]
+            runs = manifest.get("runs", {})
+            names = manifest["segments"]
+            if resume_state is not None and not read_only:
+                names = resume_state["segments"]
+            elif run is not None and not read_only:
+                # Digests of an earlier run of this job would flag all its rows
+                names = [name for name in names if runs.get(name) != run]
+                if len(names) < len(manifest["segments"]):
+                    print(f"\tReplacing the digests of an earlier run in {path}")
+            for name in names:
+                self.segment_names.append(name)
+                self.segment_runs[name] = runs.get(name)
+                self.segments.append(np.load(os.path.join(path, name), mmap_mode="r"))
+            if not read_only:
+                for name in set(manifest["segments"]) - set(names):
+                    os.remove(os.path.join(path, name))
+                self.save_manifest()
+        elif path is not None:
+            assert not read_only, f"No dedup index found at {path}"
+            os.makedirs(path, exist_ok=True)
+        if path is not None and not read_only:
+            snapshots = sorted(glob.glob(os.path.join(path, "buffer_*.npy")))
+            if len(snapshots) > 0:
+                self.next_snapshot = snapshot_number(snapshots[-1]) + 1
+            if resume_state is not None:
+                self.buffer = np.load(os.path.join(path, resume_state["buffer"]))
+            for snapshot in snapshots:
+                os.remove(snapshot)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.path, "index.json")
+
+    def __len__(self) -> int:
+        return len(self.buffer) + sum(len(segment) for segment in self.segments)
+
+    def save_manifest(self) -> None:
+        manifest = {
+            "digest_bits": self.digest_bits,
+            "entries": len(self) - len(self.buffer),
+            "next_segment": self.next_segment,
+            "segments": self.segment_names,
+            "runs": self.segment_runs,
+        }
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def contains(self, digests: np.ndarray) -> np.ndarray:
+        """Check which digests are already in the index."""
+        found = contains_sorted(self.buffer, digests)
+        for segment in self.segments:
+            found |= contains_sorted(segment, digests)
+        return found
+
+    def add(self, digests: np.ndarray) -> None:
+        """Add digests, spilling the buffer to disk once it is full."""
+        assert not self.read_only, "Cannot add to a read-only dedup index"
+        self.buffer = np.union1d(self.buffer, digests)
+        if self.path is not None and len(self.buffer) >= self.max_memory_entries:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered digests to a new segment."""
+        if self.path is None or self.read_only or len(self.buffer) == 0:
+            return
+        name = f"segment_{self.next_segment:06d}.npy"
+        np.save(os.path.join(self.path, name), self.buffer)
+        self.next_segment += 1
+        self.segment_names.append(name)
+        self.segment_runs[name] = self.run
+        self.segments.append(np.load(os.path.join(self.path, name), mmap_mode="r"))
+        self.buffer = np.empty(0, dtype=self.dtype)
+        self.save_manifest()
+
+    def state(self) -> dict:
+        """
+        Return what is needed to roll back to the digests added so far. The
+        buffer is saved to a snapshot file rather than flushed, so that
+        recording state after every chunk does not add a segment per chunk.
+        """
+        assert self.path is not None, "Only an index with a path can be rolled back"
+        name = f"buffer_{self.next_snapshot:06d}.npy"
+        np.save(os.path.join(self.path, name), self.buffer)
+        self.next_snapshot += 1
+        return {"segments": list(self.segment_names), "buffer": name}
+
+    def release(self, state: dict) -> None:
+        """Delete the buffer snapshots taken before `state`, which is now saved."""
+        number = snapshot_number(state["buffer"])
+        for snapshot in glob.glob(os.path.join(self.path, "buffer_*.npy")):
+            if snapshot_number(snapshot) < number:
+                os.remove(snapshot)
+
+    def compact(self) -> None:
+        """Merge the buffer and the segments written by this run into one segment."""
+        if self.path is None or self.read_only:
+            return
+        own = [
+            name for name in self.segment_names if self.segment_runs[name] == self.run
+        ]
+        if len(own) + (len(self.buffer) > 0) <= 1:
+            self.flush()
+            return
+        merged = np.concatenate(
+            [
+                *(s for n, s in zip(self.segment_names, self.segments) if n in own),
+                self.buffer,
+            ]
+        )
+        merged.sort()
+        self.segments = [
+            s for n, s in zip(self.segment_names, self.segments) if n not in own
+        ]
+        self.segment_names = [n for n in self.segment_names if n not in own]
+        for name in own:
+            del self.segment_runs[name]
+        self.buffer = merged
+        self.flush()
+        for name in own:
+            os.remove(os.path.join(self.path, name))
+
+    def check_and_add(self, digests: np.ndarray) -> np.ndarray:
+        """
+        Flag digests already in this index or a reference index, or seen earlier
+        in `digests`, then add the new ones. The first occurrence of a digest is
+        not a duplicate, matching `DataFrame.duplicated`.
+        """
+        _, first = np.unique(digests, return_index=True)
+        duplicate = np.ones(len(digests), dtype=bool)
+        duplicate[first] = False
+        for index in [self, *self.references]:
+            duplicate |= index.contains(digests)
+        if not self.read_only:
+            self.add(digests[~duplicate])
+        return duplicate
+
+    def close(self) -> None:
+        """Merge everything this run wrote into one segment, ready to be shared."""
+        self.compact()
+        if self.path is not None and not self.read_only:
+            for snapshot in glob.glob(os.path.join(self.path, "buffer_*.npy")):
+                os.remove(snapshot)
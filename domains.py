@@ -0,0 +1,236 @@
+import argparse
+import enum
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Host of an absolute, protocol-relative or scheme-less URL, skipping user info
+# and stopping before the port, path, query or fragment
+HOST_PATTERN = (
+    r"^(?:(?:[A-Za-z][A-Za-z0-9+.-]*:)?//)?(?:[^@/?#]*@)?"
+    r"(?P<host>\[[^\]]*\]|[^:/?#@]*)"
+)
+# Key of the SipHash used for domain hashes; changing it invalidates saved indexes
+HASH_KEY = "domainpolicy0001"
+# Slots of the hash table per domain, so probes stay short
+TABLE_LOAD_FACTOR = 0.5
+TABLE_DTYPE = np.dtype([("key", "<u8"), ("action", "u1")])
+
+
+class DomainAction(enum.IntEnum):
+    NONE = 0  # Empty slot, or no entry for the domain
+    ALLOW = 1
+    BLOCK = 2
+
+
+def normalise_hosts(urls: pd.Series) -> pd.Series:
+    """
+    Extract the host of each URL, lowercased and without a `www.` prefix, port,
+    user info or trailing dot. URLs without a host give None.
+    """
+    hosts = pc.struct_field(
+        pc.extract_regex(
+            pa.array(urls, type=pa.string(), from_pandas=True), HOST_PATTERN
+        ),
+        [0],
+    )
+    hosts = pc.replace_substring_regex(
+        pc.utf8_lower(hosts), r"^www\.", "", max_replacements=1
+    )
+    hosts = pc.utf8_rtrim(hosts, characters=".")
+    hosts = pc.if_else(pc.equal(hosts, ""), pa.scalar(None, pa.string()), hosts)
+    return pd.Series(
+        hosts.to_numpy(zero_copy_only=False), index=urls.index, dtype=object
+    )
+
+
+def hash_domains(domains: np.ndarray) -> np.ndarray:
+    """Hash domain strings to 64-bit keys, never 0, which marks an empty slot."""
+    if len(domains) == 0:
+        return np.empty(0, dtype=np.uint64)
+    keys = pd.util.hash_array(np.asarray(domains, dtype=object), hash_key=HASH_KEY)
+    keys[keys == 0] = 1
+    return keys
+
+
+def read_domain_list(path: str) -> list[str]:
+    """
+    Read one domain per line, ignoring blank lines and `#` comments. Hosts-file
+    lines (`0.0.0.0 example.com`) and wildcards (`*.example.com`) are accepted.
+    """
+    domains = []
+    with open(path, "r") as file:
+        for line in file:
+            line = line.split("#", 1)[0].split()
+            if len(line) > 0:
+                domains.append(line[-1])
+    if len(domains) == 0:
+        return []
+    return normalise_hosts(pd.Series(domains).str.lstrip("*.")).dropna().tolist()
+
+
+class DomainPolicy:
+    """
+    Allow and block lists of domains, stored as an open-addressing hash table
+    of 64-bit domain hashes that can be saved to `.npy` and memory-mapped, so
+    lists of millions of domains load instantly and are shared between
+    processes. A host matches an entry for itself or any parent domain, and the
+    most specific match decides: blocking `example.com` and allowing
+    `docs.example.com` blocks every other host under `example.com`. Hosts
+    matching no entry get the `default` action.
+    """
+
+    def __init__(self, table: np.ndarray, default: DomainAction = DomainAction.ALLOW):
+        assert len(table) & (len(table) - 1) == 0, "Table size must be a power of two"
+        self.table = table
+        self.mask = np.uint64(len(table) - 1)
+        self.default = default
+
+    @classmethod
+    def from_domains(
+        cls,
+        allow: list[str] = [],
+        block: list[str] = [],
+        default: DomainAction = DomainAction.ALLOW,
+    ) -> "DomainPolicy":
+        """Build a policy from lists of domains, allowing any listed in both."""
+        entries = pd.Series(
+            [DomainAction.ALLOW] * len(allow) + [DomainAction.BLOCK] * len(block),
+            index=hash_domains(np.array(allow + block, dtype=object)),
+            dtype=np.uint8,
+        )
+        entries = entries[~entries.index.duplicated(keep="first")]
+        size = 1 << max(int(np.ceil(np.log2(len(entries) / TABLE_LOAD_FACTOR + 1))), 1)
+        table = np.zeros(size, dtype=TABLE_DTYPE)
+        keys, actions = entries.index.to_numpy(np.uint64), entries.to_numpy()
+        slots = keys & np.uint64(size - 1)
+        # Linear probing, inserting one key per free slot in each round
+        while len(keys) > 0:
+            free = table["key"][slots] == 0
+            _, first = np.unique(slots[free], return_index=True)
+            placed = np.flatnonzero(free)[first]
+            table["key"][slots[placed]] = keys[placed]
+            table["action"][slots[placed]] = actions[placed]
+            remaining = np.ones(len(keys), dtype=bool)
+            remaining[placed] = False
+            keys, actions = keys[remaining], actions[remaining]
+            slots = (slots[remaining] + np.uint64(1)) & np.uint64(size - 1)
+        return cls(table, default)
+
+    @classmethod
+    def from_files(
+        cls,
+        allow_paths: list[str] = [],
+        block_paths: list[str] = [],
+        default: DomainAction = DomainAction.ALLOW,
+    ) -> "DomainPolicy":
+        allow = [domain for path in allow_paths for domain in read_domain_list(path)]
+        block = [domain for path in block_paths for domain in read_domain_list(path)]
+        return cls.from_domains(allow, block, default)
+
+    @classmethod
+    def load(
+        cls, path: str, default: DomainAction = DomainAction.ALLOW
+    ) -> "DomainPolicy":
+        """Memory-map a policy saved with `save`."""
+        return cls(np.load(path, mmap_mode="r"), default)
+
+    def save(self, path: str) -> None:
+        np.save(path, self.table)
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.table["key"]))
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Return the action stored for each key, or NONE for keys not in the table."""
+        actions = np.zeros(len(keys), dtype=np.uint8)
+        slots = keys & self.mask
+        active = np.arange(len(keys))
+        while len(active) > 0:
+            entries = self.table[slots[active]]
+            found = entries["key"] == keys[active]
+            actions[active[found]] = entries["action"][found]
+            active = active[~found & (entries["key"] != 0)]
+            slots[active] = (slots[active] + np.uint64(1)) & self.mask
+        return actions
+
+    def actions(self, hosts: pd.Series) -> np.ndarray:
+        """Return the action of the most specific entry matching each host."""
+        # Hosts repeat across rows, so each distinct host is only checked once
+        codes, uniques = pd.factorize(hosts)
+        actions = np.full(len(uniques) + 1, int(self.default), dtype=np.uint8)
+        rows = np.arange(len(uniques))
+        domains = pa.array(uniques, type=pa.string())
+        # Check each host, then its parent domains, from most to least specific
+        while len(rows) > 0:
+            matched = self.lookup(hash_domains(domains.to_numpy(zero_copy_only=False)))
+            actions[rows[matched != 0]] = matched[matched != 0]
+            parent = pc.and_(
+                pc.equal(pa.array(matched), 0), pc.match_substring(domains, ".")
+            ).to_numpy(zero_copy_only=False)
+            rows = rows[parent]
+            domains = pc.replace_substring_regex(
+                domains.filter(pa.array(parent)), r"^[^.]*\.", "", max_replacements=1
+            )
+        # Missing hosts have code -1, which picks the default action at the end
+        return actions[codes]
+
+    def allowed(self, hosts: pd.Series) -> pd.Series:
+        """Check which hosts the policy allows."""
+        return pd.Series(self.actions(hosts) != DomainAction.BLOCK, index=hosts.index)
+
+
+class DomainQuota:
+    """
+    Keep at most `max_docs` rows per host, counted across every chunk passed
+    through `within_quota` in order, starting from the `counts` of an earlier
+    quota's `state()` if given. Rows without a host are not capped.
+    """
+
+    def __init__(self, max_docs: int, counts: np.ndarray | None = None):
+        self.max_docs = max_docs
+        self.counts: dict[int, int] = {}
+        if counts is not None:
+            self.counts = dict(counts.tolist())
+
+    def within_quota(self, hosts: pd.Series) -> pd.Series:
+        """Check which rows fit within their host's quota, counting the ones that do."""
+        keep = pd.Series(True, index=hosts.index)
+        known = hosts.notna()
+        if not known.any():
+            return keep
+        keys = pd.Series(hash_domains(hosts[known].to_numpy(dtype=object)))
+        unique, counts = np.unique(keys.to_numpy(), return_counts=True)
+        seen = np.array([self.counts.get(key, 0) for key in unique.tolist()])
+        # Rank of each row among the rows of its host, after those already seen
+        rank = keys.groupby(keys).cumcount().to_numpy()
+        rank += seen[np.searchsorted(unique, keys.to_numpy())]
+        keep[known] = rank < self.max_docs
+        self.counts.update(
+            zip(unique.tolist(), np.minimum(seen + counts, self.max_docs).tolist())
+        )
+        return keep
+
+    def state(self) -> np.ndarray:
+        """Return the rows kept so far for each host, as (host hash, count) pairs."""
+        return np.array(list(self.counts.items()), dtype=np.uint64).reshape(-1, 2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compile allow and block lists into a memory-mappable domain policy."
+    )
+    parser.add_argument("output", help="Path of the .npy policy index to write")
+    parser.add_argument("--allow", nargs="*", default=[], help="Allow list files")
+    parser.add_argument("--block", nargs="*", default=[], help="Block list files")
+    args = parser.parse_args()
+
+    policy = DomainPolicy.from_files(args.allow, args.block)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    policy.save(args.output)
+    print(
+        f"Saved {len(policy)} domains ({policy.table.nbytes / 1e6:.1f} MB) to {args.output}"
+    )
@@ -0,0 +1,266 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable
+
+# Seconds between checks for a failure elsewhere while waiting on a queue
+POLL_INTERVAL = 0.1
+# Marks the end of the items passed along a queue
+_DONE = object()
+
+
+class Stopped(Exception):
+    """Raised in a thread waiting on a queue once another thread has failed."""
+
+
+class MonitoredQueue:
+    """Bounded queue recording its depth and the time spent waiting on it."""
+
+    def __init__(self, maxsize: int, stop: threading.Event):
+        self.queue: queue.Queue = queue.Queue(maxsize)
+        self.maxsize = maxsize
+        self.stop = stop
+        self.lock = threading.Lock()
+        self.put_wait_s = 0.0
+        self.get_wait_s = 0.0
+        self.depth_total = 0
+        self.samples = 0
+        self.max_depth = 0
+
+    def sample(self) -> None:
+        depth = self.queue.qsize()
+        self.depth_total += depth
+        self.samples += 1
+        self.max_depth = max(self.max_depth, depth)
+
+    def put(self, item: Any) -> float:
+        """Put an item, blocking while the queue is full. Returns the time blocked."""
+        start = time.perf_counter()
+        while True:
+            if self.stop.is_set():
+                raise Stopped
+            try:
+                self.queue.put(item, timeout=POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        waited = time.perf_counter() - start
+        with self.lock:
+            self.put_wait_s += waited
+            self.sample()
+        return waited
+
+    def get(self) -> tuple[Any, float]:
+        """Get an item, blocking while the queue is empty. Returns it and the wait."""
+        start = time.perf_counter()
+        while True:
+            if self.stop.is_set():
+                raise Stopped
+            try:
+                item = self.queue.get(timeout=POLL_INTERVAL)
+                break
+            except queue.Empty:
+                continue
+        waited = time.perf_counter() - start
+        with self.lock:
+            self.get_wait_s += waited
+            self.sample()
+        return item, waited
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.maxsize,
+            "mean_depth": self.depth_total / self.samples if self.samples else 0.0,
+            "max_depth": self.max_depth,
+            "put_wait_s": self.put_wait_s,
+            "get_wait_s": self.get_wait_s,
+        }
+
+
+class PipelinedExecutor:
+    """
+    Overlap reading, processing and writing. A reader thread pulls items from an
+    iterable into a bounded queue, `workers` threads process them into a second
+    bounded queue, and the calling thread writes the results. At most
+    `2 * queue_depth + workers` items are in flight, so a slow writer holds the
+    reader back rather than letting items pile up in memory. With `ordered`,
+    results are written in input order; otherwise as soon as they are ready.
+
+    Each stage records the time it spends busy, waiting for input (starved) and
+    waiting for space downstream (blocked), and each queue its depth, so the
+    bottleneck is the stage that is busy while the others wait on it.
+    """
+
+    def __init__(self, workers: int = 1, queue_depth: int = 2, ordered: bool = True):
+        assert workers >= 1, "The executor needs at least one worker"
+        assert queue_depth >= 1, "Queues need room for at least one item"
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.ordered = ordered
+        self.stages = {
+            name: {"items": 0, "busy_s": 0.0, "starved_s": 0.0, "blocked_s": 0.0}
+            for name in ["read", "process", "write"]
+        }
+        self.queues: dict[str, MonitoredQueue] = {}
+        self.wall_time_s = 0.0
+        self.lock = threading.Lock()
+
+    def add_time(self, stage: str, **times: float) -> None:
+        with self.lock:
+            for key, seconds in times.items():
+                self.stages[stage][key] += seconds
+
+    def run(
+        self,
+        items: Iterable,
+        process: Callable[[int, Any], Any],
+        write: Callable[[int, Any], None],
+    ) -> None:
+        """
+        Call `process(i, item)` for each item on the worker threads and
+        `write(i, result)` on this thread. The first exception raised by any
+        stage stops the others and is re-raised here.
+        """
+        stop = threading.Event()
+        errors: list[BaseException] = []
+        inputs = MonitoredQueue(self.queue_depth, stop)
+        outputs = MonitoredQueue(self.queue_depth, stop)
+        self.queues = {"input": inputs, "output": outputs}
+        in_flight = threading.Semaphore(2 * self.queue_depth + self.workers)
+
+        def fail(error: BaseException) -> None:
+            with self.lock:
+                errors.append(error)
+            stop.set()
+
+        def read() -> None:
+            try:
+                iterator = iter(items)
+                i = 0
+                while True:
+                    start = time.perf_counter()
+                    while not in_flight.acquire(timeout=POLL_INTERVAL):
+                        if stop.is_set():
+                            return
+                    blocked = time.perf_counter() - start
+                    start = time.perf_counter()
+                    item = next(iterator, _DONE)
+                    busy = time.perf_counter() - start
+                    if item is _DONE:
+                        in_flight.release()
+                        break
+                    blocked += inputs.put((i, item))
+                    self.add_time("read", items=1, busy_s=busy, blocked_s=blocked)
+                    i += 1
+                for _ in range(self.workers):
+                    inputs.put(_DONE)
+            except Stopped:
+                pass
+            except BaseException as e:
+                fail(e)
+
+        def work() -> None:
+            try:
+                while True:
+                    entry, starved = inputs.get()
+                    if entry is _DONE:
+                        outputs.put(_DONE)
+                        return
+                    i, item = entry
+                    start = time.perf_counter()
+                    result = process(i, item)
+                    busy = time.perf_counter() - start
+                    blocked = outputs.put((i, result))
+                    self.add_time(
+                        "process",
+                        items=1,
+                        busy_s=busy,
+                        starved_s=starved,
+                        blocked_s=blocked,
+                    )
+            except Stopped:
+                pass
+            except BaseException as e:
+                fail(e)
+
+        threads = [threading.Thread(target=read, name="reader", daemon=True)]
+        threads += [
+            threading.Thread(target=work, name=f"worker-{n}", daemon=True)
+            for n in range(self.workers)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            pending: dict[int, Any] = {}
+            next_index, workers_done = 0, 0
+            while workers_done < self.workers:
+                entry, starved = outputs.get()
+                self.add_time("write", starved_s=starved)
+                if entry is _DONE:
+                    workers_done += 1
+                    continue
+                pending[entry[0]] = entry[1]
+                while len(pending) > 0:
+                    if self.ordered and next_index not in pending:
+                        break
+                    i = next_index if self.ordered else next(iter(pending))
+                    result = pending.pop(i)
+                    start = time.perf_counter()
+                    write(i, result)
+                    self.add_time("write", items=1, busy_s=time.perf_counter() - start)
+                    in_flight.release()
+                    next_index += 1
+        except Stopped:
+            pass
+        except BaseException as e:
+            fail(e)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self.wall_time_s += time.perf_counter() - started
+        if len(errors) > 0:
+            raise errors[0]
+
+    def stats(self) -> dict:
+        """Return the time each stage spent busy and waiting, and the queue depths."""
+        threads = {"read": 1, "process": self.workers, "write": 1}
+        stages = {
+            name: {
+                **stage,
+                "threads": threads[name],
+                "utilisation": stage["busy_s"] / self.wall_time_s / threads[name]
+                if self.wall_time_s > 0
+                else None,
+            }
+            for name, stage in self.stages.items()
+        }
+        return {
+            "wall_time_s": self.wall_time_s,
+            "workers": self.workers,
+            "ordered": self.ordered,
+            "stages": stages,
+            "queues": {name: q.stats() for name, q in self.queues.items()},
+            "bottleneck": max(
+                stages, key=lambda name: stages[name]["busy_s"] / threads[name]
+            ),
+        }
+
+    def print_stats(self) -> None:
+        """Print how busy each stage was and how full the queues ran."""
+        stats = self.stats()
+        print(f"Pipelined execution ({stats['wall_time_s']:.2f}s):")
+        for name, stage in stats["stages"].items():
+            utilisation = stage["utilisation"] or 0.0
+            print(
+                f"\t{name}: {stage['items']} items, busy {stage['busy_s']:.2f}s "
+                f"({utilisation:.0%}), starved {stage['starved_s']:.2f}s, "
+                f"blocked {stage['blocked_s']:.2f}s"
+            )
+        for name, q in stats["queues"].items():
+            print(
+                f"\t{name} queue: mean depth {q['mean_depth']:.1f}, "
+                f"max {q['max_depth']} of {q['capacity']}"
+            )
+        print(f"\tBottleneck: {stats['bottleneck']}")
@@ -1,5 +1,9 @@
+import argparse
 import os
 import sys
+from typing import Iterator
+
+import numpy as np
 import pandas as pd
 from processor import (
     clean_text_ascii,
@@ -10,45 +14,462 @@ from processor import (
     check_text_is_alphabetic,
     check_text_is_hyperlink,
     deduplicate_data,
+    deduplicate_near_data,
+    prefilter_short_length,
     extract_domain_from_col,
+    cap_domain_docs,
     extract_language,
     tokenise_texts,
     LanguageTool,
 )
+import backends
+from cache import ResultCache
+from checkpoint import Checkpoint, run_key
 from config import read_config
-from splitting import split_data
+from dedup_index import DedupIndex
+from domains import DomainAction, DomainPolicy, DomainQuota
+from executor import PipelinedExecutor
+from dataio import TableWriter, read_table, read_table_chunks, with_extension
+from htmlclean import HtmlEngine
+from memory import compact_frame, frame_bytes
+from pipeline import CostClass, Stage, plan_stages, run_pipeline
+from profiling import PipelineProfiler
+from splitting import SplitMethod, hash_split, split_data
+from tokeniser import DEFAULT_MODELS
+from tokenshards import DEFAULT_MAX_TOKENS_PER_SHARD, TokenShardWriter
+
+
+def load_data(
+    file_path: str, input_format: str | None = None, **kwargs
+) -> pd.DataFrame:
+    """Load data from JSONL, Parquet or Arrow files into a pandas DataFrame."""
+    return read_table(file_path, input_format, **kwargs)
+
+
+def load_data_chunks(
+    file_path: str, chunksize: int, input_format: str | None = None, **kwargs
+) -> Iterator[pd.DataFrame]:
+    """Lazily load data in DataFrames of at most `chunksize` rows."""
+    yield from read_table_chunks(file_path, chunksize, input_format, **kwargs)
+
+
+def build_stages(
+    config: dict,
+    language_tool: LanguageTool,
+    cache: ResultCache | None = None,
+    dedup_index: DedupIndex | None = None,
+    domain_policy: DomainPolicy | None = None,
+    domain_quota: DomainQuota | None = None,
+) -> list[Stage]:
+    """Declare the cleaning and filtering steps, in their reference order."""
+    filters: dict = config.get("filters", {})
+    cleaners: dict = config.get("cleaners", {})
+    n_workers = config.get("n_workers", 1)
+    min_text_length = filters.get("filter_text_length_threshold", 50)
+    html_engine = HtmlEngine(cleaners.get("html_engine", "lxml"))
+    return [
+        Stage(
+            "deduplicate_data",
+            deduplicate_data,
+            CostClass.CHEAP,
+            reads=("text",),
+            writes=("duplicate", "text_original", "text"),
+            kwargs={
+                "apply_filter": filters.get("filter_duplicates", True),
+                "fields": ["text"],
+                "index": dedup_index,
+                "keep_original": config.get("keep_text_original", True),
+            },
+            filters=filters.get("filter_duplicates", True),
+            row_local=False,
+        ),
+        Stage(
+            "deduplicate_near_data",
+            deduplicate_near_data,
+            CostClass.MODERATE,
+            reads=("text",),
+            writes=("near_duplicate_cluster",),
+            kwargs={
+                "threshold": filters.get("near_duplicate_threshold", 0.8),
+                "num_perm": filters.get("near_duplicate_num_perm", 128),
+                "shingle_size": filters.get("near_duplicate_shingle_size", 5),
+                "apply_filter": filters.get("filter_near_duplicates", False),
+            },
+            filters=filters.get("filter_near_duplicates", False),
+            row_local=False,
+            enabled=filters.get(
+                "near_duplicate_detection",
+                filters.get("filter_near_duplicates", False),
+            ),
+        ),
+        # Early elimination of rows that clean_short_length would drop anyway
+        Stage(
+            "prefilter_short_length",
+            prefilter_short_length,
+            CostClass.CHEAP,
+            reads=("text",),
+            kwargs={"min_text_length": min_text_length},
+            filters=True,
+        ),
+        Stage(
+            "clean_text_ascii",
+            clean_text_ascii,
+            CostClass.CHEAP,
+            reads=("text",),
+            writes=("text",),
+            kwargs={"n_workers": n_workers},
+            enabled=cleaners.get("remove_ascii_characters", True),
+        ),
+        Stage(
+            "check_text_is_alphabetic",
+            check_text_is_alphabetic,
+            CostClass.CHEAP,
+            reads=("text",),
+            writes=("has_alphabetic",),
+            kwargs={
+                "apply_filter": filters.get("filter_alphabetic_only", True),
+                "n_workers": n_workers,
+            },
+            filters=filters.get("filter_alphabetic_only", True),
+        ),
+        Stage(
+            "check_text_is_hyperlink",
+            check_text_is_hyperlink,
+            CostClass.CHEAP,
+            reads=("text",),
+            writes=("is_hyperlink",),
+            kwargs={
+                "apply_filter": filters.get("filter_hyperlinks", True),
+                "n_workers": n_workers,
+            },
+            filters=filters.get("filter_hyperlinks", True),
+        ),
+        Stage(
+            "clean_text_html",
+            clean_text_html,
+            # Only the BeautifulSoup engine parses documents without markup
+            CostClass.EXPENSIVE
+            if html_engine == HtmlEngine.BS4
+            else CostClass.MODERATE,
+            reads=("text",),
+            writes=("text",),
+            kwargs={"n_workers": n_workers, "engine": html_engine},
+            enabled=cleaners.get("html_normalise", True),
+        ),
+        Stage(
+            "clean_short_length",
+            clean_short_length,
+            CostClass.CHEAP,
+            reads=("text",),
+            writes=("text_length", "word_length"),
+            kwargs={
+                "min_text_length": min_text_length,
+                "min_word_count": filters.get("filter_word_count_threshold", 20),
+            },
+            filters=True,
+        ),
+        Stage(
+            "check_text_is_code",
+            check_text_is_code,
+            CostClass.MODERATE,
+            reads=("text",),
+            writes=("is_code", "code_score"),
+            kwargs={
+                "apply_filter": filters.get("filter_code", False),
+                "n_workers": n_workers,
+                "threshold": filters.get("code_threshold", 0.4),
+                "margin": filters.get("code_lexer_margin", 0.1),
+                "prefix_chars": filters.get("code_lexer_prefix_chars", 2000),
+            },
+            filters=filters.get("filter_code", False),
+            enabled=filters.get("detect_code", filters.get("filter_code", False)),
+        ),
+        Stage(
+            "extract_domain_from_col",
+            extract_domain_from_col,
+            CostClass.CHEAP,
+            reads=("url",),
+            writes=("domain",),
+            kwargs={
+                "filter_github": filters.get("filter_github", True),
+                "policy": domain_policy,
+            },
+            filters=filters.get("filter_github", True) or "domain_policy" in config,
+        ),
+        Stage(
+            "extract_language",
+            extract_language,
+            CostClass.EXPENSIVE,
+            reads=("text",),
+            writes=(
+                "detected_language",
+                "detected_language_lang",
+                "detected_language_prob",
+            ),
+            kwargs={
+                "tool": language_tool,
+                "en_only": filters.get("filter_en_only", True),
+                "en_threshold": filters.get("filter_en_threshold", 0.9),
+                "n_workers": n_workers,
+                "cache": cache,
+                "candidate_languages": tuple(
+                    filters.get(
+                        "lingua_candidate_languages",
+                        ["en", "de", "fr", "es", "it", "pt", "nl"],
+                    )
+                ),
+                "sample_chars": filters.get("lingua_sample_chars", 1000),
+                "fallback_margin": filters.get("lingua_fallback_margin", 0.1),
+            },
+            filters=filters.get("filter_en_only", True),
+        ),
+        Stage(
+            "detect_pii",
+            detect_pii,
+            CostClass.EXPENSIVE,
+            reads=("text",),
+            writes=("has_pii", "pii_entity_types", "pii_spans", "text"),
+            kwargs={
+                "mask": filters.get("mask_pii", False),
+                "cache": cache,
+                "prescreen": filters.get("pii_prescreen", False),
+                "entities": filters.get("pii_entities"),
+                "n_process": filters.get("pii_n_process", 4),
+                "batch_size": filters.get("pii_batch_size", 100),
+                "shard_size": filters.get("pii_shard_size", 10_000),
+            },
+            enabled=filters.get("detect_pii", True),
+        ),
+        # Declared after the other filters, so only rows that pass them count
+        Stage(
+            "cap_domain_docs",
+            cap_domain_docs,
+            CostClass.CHEAP,
+            reads=("domain",),
+            kwargs={"quota": domain_quota},
+            filters=True,
+            row_local=False,
+            enabled=config.get("domain_policy", {}).get("max_docs_per_domain")
+            is not None,
+        ),
+        Stage(
+            "tokenise_texts",
+            tokenise_texts,
+            CostClass.MODERATE,
+            reads=("text",),
+            writes=("token_count", "token_ids")
+            if "token_shards" in config
+            else ("token_count",),
+            kwargs={
+                "method": config.get("tokenisation_method", "tiktoken"),
+                "cache": cache,
+                "keep_ids": "token_shards" in config,
+            },
+        ),
+    ]
+
+
+def process_data(
+    data: pd.DataFrame,
+    config: dict,
+    language_tool: LanguageTool,
+    cache: ResultCache | None = None,
+    profiler: PipelineProfiler | None = None,
+    checkpoint: Checkpoint | None = None,
+    dedup_index: DedupIndex | None = None,
+    domain_policy: DomainPolicy | None = None,
+    domain_quota: DomainQuota | None = None,
+) -> pd.DataFrame:
+    """Run the cleaning and filtering steps over a DataFrame."""
+    return run_pipeline(
+        data,
+        build_stages(
+            config, language_tool, cache, dedup_index, domain_policy, domain_quota
+        ),
+        profiler=profiler,
+        reorder=config.get("reorder_stages", True),
+        checkpoint=checkpoint,
+    )
+
+
+def load_domain_policy(
+    config: dict, quota_counts: np.ndarray | None = None
+) -> tuple[DomainPolicy | None, DomainQuota | None]:
+    """
+    Build the domain policy from its allow and block lists, saving it to `index`
+    if given, or memory-map a policy saved there before; and the domain quota,
+    starting from `quota_counts` if given.
+    """
+    policy_config: dict = config.get("domain_policy", {})
+    default = DomainAction[policy_config.get("default", "allow").upper()]
+    policy = None
+    if "allow" in policy_config or "block" in policy_config:
+        print("Building domain policy...")
+        policy = DomainPolicy.from_files(
+            policy_config.get("allow", []), policy_config.get("block", []), default
+        )
+        print(f"\t{len(policy)} domains")
+        if "index" in policy_config:
+            policy.save(policy_config["index"])
+            print(f"\tSaved domain policy to {policy_config['index']}")
+    elif "index" in policy_config:
+        policy = DomainPolicy.load(policy_config["index"], default)
+        print(f"Loaded domain policy of {len(policy)} domains")
+    quota = None
+    if policy_config.get("max_docs_per_domain") is not None:
+        quota = DomainQuota(policy_config["max_docs_per_domain"], quota_counts)
+    return policy, quota
+
+
+def compact_data(
+    data: pd.DataFrame, name: str, profiler: PipelineProfiler, compact: bool = False
+) -> pd.DataFrame:
+    """Compact the DataFrame if `compact` is set, recording its bytes per row."""
+    bytes_before = frame_bytes(data)
+    if compact:
+        data = compact_frame(data)
+    bytes_after = frame_bytes(data) if compact else bytes_before
+    profiler.record_memory(name, len(data), bytes_before, bytes_after)
+    return data
+
+
+def output_base(config: dict) -> str:
+    """Return the output path prefix that derived output files are named after."""
+    return f"output/{config.get('outname', 'cleaned').replace('.jsonl', '')}"
 
 
-def load_data(file_path: str, **kwargs) -> pd.DataFrame:
-    """Load data from a CSV file into a pandas DataFrame."""
-    return pd.read_json(file_path, lines=True, **kwargs)
+def output_paths(config: dict) -> dict[str, str]:
+    """Return the output file paths keyed by split name."""
+    output_format = config.get("output_format", "jsonl")
+    if config.get("splitter", {}) == {}:
+        path = f"output/{config.get('outname', 'cleaned.jsonl')}"
+        if output_format != "jsonl":
+            path = with_extension(path, output_format)
+        return {"cleaned": path}
+    base = output_base(config)
+    return {
+        "train": f"{base}_train.{output_format}",
+        "valid": f"{base}_valid.{output_format}",
+        "test": f"{base}_test.{output_format}",
+    }
+
+
+def open_writers(
+    config: dict, resume_states: dict[str, dict] | None = None
+) -> dict[str, TableWriter | TokenShardWriter]:
+    """
+    Open an output writer for each split, and a token shard writer for each
+    split under `<split>_tokens` if configured, resuming from `resume_states`
+    if given.
+    """
+    writers = {}
+    resume_states = resume_states or {}
+    for name, path in output_paths(config).items():
+        print(f"Saving {name} data to {path}")
+        writers[name] = TableWriter(
+            path,
+            config.get("output_format", "jsonl"),
+            compression=config.get("output_compression", None),
+            columns=config.get("output_columns", None),
+            resume_state=resume_states.get(name),
+        )
+        if "token_shards" in config:
+            directory = f"{output_base(config)}_{name}_tokens"
+            print(f"Saving {name} token ids to {directory}/")
+            writers[f"{name}_tokens"] = TokenShardWriter(
+                directory,
+                f"tiktoken:{DEFAULT_MODELS['tiktoken']}",
+                max_tokens_per_shard=config["token_shards"].get(
+                    "max_tokens_per_shard", DEFAULT_MAX_TOKENS_PER_SHARD
+                ),
+                resume_state=resume_states.get(f"{name}_tokens"),
+            )
+    return writers
+
+
+def split_outputs(data: pd.DataFrame, config: dict) -> dict[str, pd.DataFrame]:
+    """Split processed data if a splitter is configured, keyed by output name."""
+    splitter: dict = config.get("splitter", {})
+    if splitter == {}:
+        outputs = {"cleaned": data}
+    elif SplitMethod(splitter.get("method", "random")) == SplitMethod.HASH:
+        train, valid, test = hash_split(
+            data,
+            test_size=splitter.get("test_size", 0.3),
+            val_size=splitter.get("val_size", 0.3),
+            random_state=splitter.get("random_state", 42),
+            key=splitter.get("key", "text"),
+            group_by=splitter.get("group_by", None),
+        )
+        outputs = {"train": train, "valid": valid, "test": test}
+    elif len(data) < 3:
+        # train_test_split cannot split fewer than three rows
+        outputs = {"train": data}
+    else:
+        train, valid, test = split_data(
+            data,
+            test_size=splitter.get("test_size", 0.3),
+            val_size=splitter.get("val_size", 0.3),
+            random_state=splitter.get("random_state", 42),
+        )
+        outputs = {"train": train, "valid": valid, "test": test}
+    return outputs
+
+
+def write_outputs(
+    outputs: dict[str, pd.DataFrame],
+    writers: dict[str, TableWriter | TokenShardWriter],
+) -> None:
+    for name, split in outputs.items():
+        if "token_ids" in split.columns:
+            writers[f"{name}_tokens"].write(split["token_ids"])
+            split = split.drop(columns=["token_ids"])
+        writers[name].write(split)
+
+
+def save_data(
+    data: pd.DataFrame, config: dict, writers: dict[str, TableWriter]
+) -> dict[str, pd.DataFrame]:
+    """
+    Save processed data, splitting it first if a splitter is configured, and
+    return the DataFrame written for each split.
+    """
+    outputs = split_outputs(data, config)
+    write_outputs(outputs, writers)
+    return outputs
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clean and filter a text dataset.")
+    parser.add_argument("config", nargs="?", default="config.json")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue from the last completed stage or chunk of an earlier run",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the stage plan and the import cost of each backend, then exit",
+    )
+    args = parser.parse_args()
+
     # Config options
     try:
-        config = read_config(sys.argv[-1])
+        config = read_config(args.config)
     except Exception as e:
         print(f"Error reading config file: {e}")
         sys.exit(1)
     filters: dict = config.get("filters", {})
-    cleaners: dict = config.get("cleaners", {})
-    splitter: dict = config.get("splitter", {})
 
     nrows = config.get("nrows", None)
+    chunksize = config.get("chunksize", None)
     seed = config.get("random_seed", 42)
-
-    if not os.path.exists("output"):
-        os.makedirs("output")
-    if not os.path.exists(
-        f"output/{os.path.dirname(config.get('outname', 'cleaned'))}"
-    ):
-        os.makedirs(f"output/{os.path.dirname(config.get('outname', 'cleaned'))}")
-
-    # Load data
-    data = load_data(config["filename"], nrows=nrows)
-    print("Initial dataset size", len(data))
-    data = data.sample(frac=1, random_state=42)
+    # Hash splits do not depend on row order, so there is nothing to shuffle for
+    split_method = SplitMethod(config.get("splitter", {}).get("method", "random"))
+    shuffle = config.get("shuffle", split_method != SplitMethod.HASH)
+    compact = config.get("compact_memory", False)
+    input_columns = config.get("input_columns", None)
 
     try:
         language_tool = LanguageTool(filters.get("filter_lang_method", "lingua"))
@@ -57,88 +478,212 @@ if __name__ == "__main__":
         print("Defaulting to LINGUA")
         language_tool = LanguageTool.LINGUA
 
-    # Main data pipeline
-    data_processed = (
-        data.pipe(
-            deduplicate_data,
-            apply_filter=filters.get("filter_duplicates", True),
-            fields=["text"],
-        )
-        .pipe(
-            lambda data: clean_text_ascii(data)
-            if cleaners.get("remove_ascii_characters", True)
-            else data
-        )
-        .pipe(
-            check_text_is_alphabetic,
-            apply_filter=filters.get("filter_alphabetic_only", True),
-        )
-        .pipe(
-            check_text_is_hyperlink, apply_filter=filters.get("filter_hyperlinks", True)
-        )
-        .pipe(
-            lambda data: clean_text_html(data)
-            if cleaners.get("html_normalise", True)
-            else data
+    if args.dry_run:
+        planned = plan_stages(build_stages(config, language_tool))
+        print("Stage order:", " -> ".join(stage.name for stage in planned))
+        print("Backend import costs:")
+        backends.print_import_costs(backends.required_backends(config))
+        sys.exit(0)
+
+    if not os.path.exists("output"):
+        os.makedirs("output")
+    if not os.path.exists(
+        f"output/{os.path.dirname(config.get('outname', 'cleaned'))}"
+    ):
+        os.makedirs(f"output/{os.path.dirname(config.get('outname', 'cleaned'))}")
+
+    cache = None
+    if "cache" in config:
+        cache = ResultCache(
+            config["cache"].get("path", "output/cache.sqlite"),
+            max_entries=config["cache"].get("max_entries", 10_000_000),
         )
-        .pipe(
-            clean_short_length,
-            min_text_length=filters.get("filter_text_length_threshold", 50),
-            min_word_count=filters.get("filter_word_count_threshold", 20),
+    profiler = PipelineProfiler(profile_stage=config.get("profile_stage", None))
+    if config.get("reorder_stages", True):
+        planned = plan_stages(build_stages(config, language_tool))
+        print("Stage order:", " -> ".join(stage.name for stage in planned))
+    checkpoint = None
+    if config.get("checkpoint", False) or args.resume:
+        print("Checkpointing progress to", f"{output_base(config)}_checkpoint")
+        checkpoint = Checkpoint(
+            f"{output_base(config)}_checkpoint", config, resume=args.resume
         )
-        # .pipe(check_text_is_code, apply_filter=filters.get("filter_code", False))
-        .pipe(extract_domain_from_col, filter_github=filters.get("filter_github", True))
-        .pipe(
-            extract_language,
-            tool=language_tool,
-            en_only=filters.get("filter_en_only", True),
-            en_threshold=0.9,
+    dedup_index = None
+    if "dedup_index" in config:
+        # Checkpointed runs keep an in-memory index in the checkpoint instead, and
+        # resumed runs roll the index back to the last completed chunk or stage
+        path = config["dedup_index"].get("path", None)
+        resume_state = None
+        if checkpoint is not None:
+            path = path or checkpoint.dedup_path
+            if checkpoint.resumed:
+                resume_state = checkpoint.manifest["dedup_index"]
+        dedup_index = DedupIndex(
+            path,
+            digest_bits=config["dedup_index"].get("digest_bits", 64),
+            max_memory_entries=config["dedup_index"].get(
+                "max_memory_entries", 1_000_000
+            ),
+            references=config["dedup_index"].get("references", []),
+            run=run_key(config),
+            resume_state=resume_state,
         )
-        .pipe(detect_pii, mask=filters.get("mask_pii", False))
-        .pipe(tokenise_texts, method=config.get("tokenisation_method", "tiktoken"))
-    )
-    print("Final dataset size", len(data_processed))
-    data_processed.info()
+        if checkpoint is not None:
+            checkpoint.dedup_index = dedup_index
+    quota_counts = None
+    if chunksize is not None and checkpoint is not None and checkpoint.resumed:
+        # Resumed streaming runs carry on counting from the last completed chunk
+        quota_counts = checkpoint.domain_quota_counts()
+    domain_policy, domain_quota = load_domain_policy(config, quota_counts)
 
-    # Save processed data
-    if splitter == {}:
-        print(
-            f"Saving processed data to output/{config.get('outname', 'cleaned.jsonl')}"
+    if chunksize is None:
+        # Load data
+        data = load_data(
+            config["filename"],
+            config.get("input_format", None),
+            columns=input_columns,
+            nrows=nrows,
+            workers=config.get("read_workers", None),
         )
-        data_processed.to_json(
-            f"output/{config.get('outname', 'cleaned.jsonl')}",
-            lines=True,
-            orient="records",
+        print("Initial dataset size", len(data))
+        if shuffle:
+            data = data.sample(frac=1, random_state=42)
+        data = compact_data(data, "input", profiler, compact)
+
+        # Main data pipeline
+        data_processed = process_data(
+            data,
+            config,
+            language_tool,
+            cache,
+            profiler,
+            checkpoint,
+            dedup_index,
+            domain_policy,
+            domain_quota,
         )
+        data_processed = compact_data(data_processed, "output", profiler, compact)
+        print("Final dataset size", len(data_processed))
+        data_processed.info()
+
+        # Save processed data
+        writers = open_writers(config)
+        save_data(data_processed, config, writers)
     else:
-        train, valid, test = split_data(
-            data_processed,
-            test_size=splitter.get("test_size", 0.3),
-            val_size=splitter.get("val_size", 0.3),
-            random_state=splitter.get("random_state", 42),
-        )
-        # Save each split
-        print(
-            f"Saving training data to output/{config.get('outname', 'cleaned').replace('.jsonl', '')}_train.jsonl"
-        )
-        train.to_json(
-            f"output/{config.get('outname', 'cleaned').replace('.jsonl', '')}_train.jsonl",
-            lines=True,
-            orient="records",
-        )
-        print(
-            f"Saving validation data to output/{config.get('outname', 'cleaned').replace('.jsonl', '')}_valid.jsonl"
-        )
-        valid.to_json(
-            f"output/{config.get('outname', 'cleaned').replace('.jsonl', '')}_valid.jsonl",
-            lines=True,
-            orient="records",
-        )
-        print(
-            f"Saving test data to output/{config.get('outname', 'cleaned').replace('.jsonl', '')}_test.jsonl"
+        # Streaming mode: peak memory is bounded by the chunk size
+        print(f"Streaming input in chunks of {chunksize} rows")
+        chunks_completed, resume_states = 0, None
+        rows_in, rows_out = 0, 0
+        if checkpoint is not None and checkpoint.resumed:
+            chunks_completed = checkpoint.chunks_completed
+            resume_states = checkpoint.manifest["writers"]
+            rows_in, rows_out = checkpoint.manifest["rows"]
+            print(f"\tResuming after {chunks_completed} completed chunks")
+        writers = open_writers(config, resume_states)
+        replay = [name for name, w in writers.items() if not w.resumable]
+        chunks = load_data_chunks(
+            config["filename"],
+            chunksize,
+            config.get("input_format", None),
+            columns=input_columns,
+            nrows=nrows,
         )
-        test.to_json(
-            f"output/{config.get('outname', 'cleaned').replace('.jsonl', '')}_test.jsonl",
-            lines=True,
-            orient="records",
+
+        def process_chunk(i: int, data: pd.DataFrame) -> tuple | None:
+            """Process a chunk on a worker thread, returning what is to be written."""
+            if i < chunks_completed:
+                return None
+            print(f"Processing chunk {i} ({len(data)} rows)")
+            rows = len(data)
+            if shuffle:
+                data = data.sample(frac=1, random_state=42)
+            data = compact_data(data, "input", profiler, compact)
+            data_processed = process_data(
+                data,
+                config,
+                language_tool,
+                cache,
+                profiler,
+                dedup_index=dedup_index,
+                domain_policy=domain_policy,
+                domain_quota=domain_quota,
+            )
+            data_processed = compact_data(data_processed, "output", profiler, compact)
+            dedup_state, quota_counts = None, None
+            # Record the index and quotas as of this chunk, before later chunks
+            # add to them
+            if checkpoint is not None and dedup_index is not None:
+                dedup_state = dedup_index.state()
+            if checkpoint is not None and domain_quota is not None:
+                quota_counts = domain_quota.state()
+            outputs = split_outputs(data_processed, config)
+            return rows, outputs, dedup_state, quota_counts
+
+        def write_chunk(i: int, result: tuple | None) -> None:
+            """Write a processed chunk and record it in the checkpoint."""
+            global rows_in, rows_out
+            if result is None:
+                # Parquet and Arrow files cannot be reopened, so they are
+                # rewritten from the outputs kept in the checkpoint
+                if len(replay) > 0:
+                    write_outputs(
+                        pd.read_pickle(checkpoint.chunk_outputs_path(i)), writers
+                    )
+                return
+            rows, outputs, dedup_state, quota_counts = result
+            rows_in += rows
+            rows_out += sum(len(split) for split in outputs.values())
+            write_outputs(outputs, writers)
+            if checkpoint is not None:
+                if len(replay) > 0:
+                    # Token shards are resumable, so their ids are not kept
+                    pd.to_pickle(
+                        {
+                            name: outputs[name].drop(
+                                columns=["token_ids"], errors="ignore"
+                            )
+                            for name in replay
+                            if name in outputs
+                        },
+                        checkpoint.chunk_outputs_path(i),
+                    )
+                checkpoint.save_chunk(
+                    {name: writer.state() for name, writer in writers.items()},
+                    (rows_in, rows_out),
+                    dedup_state,
+                    quota_counts,
+                )
+
+        executor_config: dict = config.get("executor", {})
+        workers = executor_config.get("workers", 1)
+        if (dedup_index is not None or domain_quota is not None) and workers > 1:
+            print(
+                "\tProcessing chunks on one worker, so rows reach the dedup index "
+                "and domain quotas in order"
+            )
+            workers = 1
+        # Checkpoints record a count of completed chunks, so they must be in order
+        ordered = executor_config.get("ordered", True) or checkpoint is not None
+        executor = PipelinedExecutor(
+            workers, executor_config.get("queue_depth", 2), ordered
         )
+        executor.run(chunks, process_chunk, write_chunk)
+        executor.print_stats()
+        profiler.record_executor(executor.stats())
+        print("Initial dataset size", rows_in)
+        print("Final dataset size", rows_out)
+
+    for writer in writers.values():
+        writer.close()
+    if dedup_index is not None:
+        dedup_index.close()
+    if checkpoint is not None:
+        checkpoint.remove()
+    profiler.print_summary()
+    profiler.save(
+        f"{output_base(config)}_run_report.json",
+        f"{output_base(config)}_{config.get('profile_stage')}.prof",
+    )
+    if cache is not None:
+        cache.print_stats()
+        cache.close()
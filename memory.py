@@ -0,0 +1,45 @@
+import pandas as pd
+
+# Arrow-backed strings store text in one contiguous buffer rather than as one
+# Python object per row
+STRING_DTYPE = "string[pyarrow]"
+STRING_COLUMNS = ("text", "text_original")
+# Low-cardinality columns repeated across rows
+CATEGORICAL_COLUMNS = ("domain", "detected_language_lang")
+# Fixed dtypes rather than per-chunk downcasting, so that every chunk written
+# to a Parquet or Arrow file has the same schema
+DOWNCAST_DTYPES = {
+    "text_length": "int32",
+    "word_length": "int32",
+    "token_count": "int32",
+    "detected_language_prob": "float32",
+    "code_score": "float32",
+}
+# Object columns only needed while processing
+INTERMEDIATE_COLUMNS = ("detected_language",)
+
+
+def frame_bytes(data: pd.DataFrame) -> int:
+    """Return the memory used by a DataFrame, including the contents of strings."""
+    return int(data.memory_usage(index=True, deep=True).sum())
+
+
+def compact_frame(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Shrink a DataFrame: store text as Arrow-backed strings, repeated labels as
+    categoricals, lengths, counts and scores in 32 bits and columns holding only
+    bools as bools, and drop columns of intermediate Python objects.
+    """
+    data = data.drop(columns=[c for c in INTERMEDIATE_COLUMNS if c in data.columns])
+    for column in data.columns:
+        values = data[column]
+        if column in STRING_COLUMNS and values.dtype != STRING_DTYPE:
+            data[column] = values.astype(STRING_DTYPE)
+        elif column in CATEGORICAL_COLUMNS and values.dtype != "category":
+            data[column] = values.astype("category")
+        elif column in DOWNCAST_DTYPES and not values.isna().any():
+            data[column] = values.astype(DOWNCAST_DTYPES[column])
+        elif values.dtype == object and len(values) > 0:
+            if values.map(type).eq(bool).all():
+                data[column] = values.astype(bool)
+    return data
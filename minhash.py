@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+
+# Bytes of text hashed per batch, bounds the size of the shingle arrays
+BATCH_BYTES = 1 << 20
+# Permutations evaluated at once, bounds the (permutations x shingles) matrix
+PERMUTATION_BLOCK = 16
+SHINGLE_BASE = np.uint64(257)
+
+
+def optimal_bands(num_perm: int, threshold: float) -> tuple[int, int]:
+    """
+    Choose the number of LSH bands and rows per band so that the similarity at
+    which two documents become likely candidates, (1 / bands) ** (1 / rows), is
+    closest to the Jaccard threshold.
+    """
+    best = (num_perm, 1)
+    best_error = float("inf")
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows != 0:
+            continue
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+def normalise_texts(texts: pd.Series) -> pd.Series:
+    """Lowercase and collapse whitespace so formatting changes do not affect shingles."""
+    return texts.str.lower().str.replace(r"\s+", " ", regex=True).str.strip()
+
+
+def shingle_hashes(
+    texts: list[bytes], shingle_size: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Hash every `shingle_size`-byte window of each document. Returns the hashes of
+    all documents concatenated, with the offset of each document's first shingle.
+    Documents shorter than a shingle are padded so they have exactly one.
+    """
+    texts = [text.ljust(shingle_size, b"\0") for text in texts]
+    lengths = np.fromiter(
+        (len(text) for text in texts), dtype=np.int64, count=len(texts)
+    )
+    buffer = np.frombuffer(b"".join(texts), dtype=np.uint8).astype(np.uint64)
+    n_windows = len(buffer) - shingle_size + 1
+
+    hashes = np.zeros(n_windows, dtype=np.uint64)
+    for j in range(shingle_size):
+        hashes = hashes * SHINGLE_BASE + buffer[j : j + n_windows]
+
+    # Only keep windows that start and end inside the same document
+    doc_ids = np.repeat(np.arange(len(texts)), lengths)
+    valid = doc_ids[:n_windows] == doc_ids[shingle_size - 1 :]
+    counts = lengths - shingle_size + 1
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    return hashes[valid], offsets
+
+
+def minhash_signatures(
+    texts: pd.Series, num_perm: int = 128, shingle_size: int = 5, seed: int = 42
+) -> np.ndarray:
+    """Compute a (documents x num_perm) uint32 MinHash signature matrix."""
+    rng = np.random.default_rng(seed)
+    # Multiply-shift hashing: odd 64-bit multipliers, result taken from the high bits
+    a = rng.integers(0, 2**64, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**64, size=num_perm, dtype=np.uint64)
+
+    encoded = normalise_texts(texts).str.encode("utf-8").to_list()
+    signatures = np.empty((len(encoded), num_perm), dtype=np.uint32)
+    start = 0
+    while start < len(encoded):
+        stop, batch_bytes = start, 0
+        while stop < len(encoded) and (stop == start or batch_bytes < BATCH_BYTES):
+            batch_bytes += len(encoded[stop])
+            stop += 1
+        hashes, offsets = shingle_hashes(encoded[start:stop], shingle_size)
+        for p in range(0, num_perm, PERMUTATION_BLOCK):
+            block = slice(p, p + PERMUTATION_BLOCK)
+            permuted = a[block, None] * hashes[None, :] + b[block, None]
+            permuted >>= np.uint64(32)
+            signatures[start:stop, block] = np.minimum.reduceat(
+                permuted, offsets, axis=1
+            ).T
+        start = stop
+    return signatures
+
+
+def lsh_candidate_pairs(signatures: np.ndarray, bands: int, rows: int) -> np.ndarray:
+    """
+    Bucket documents by each band of their signature and return (document,
+    bucket representative) pairs for every document sharing a bucket. Each band
+    is a sort over the documents, so this is O(bands * n log n).
+    """
+    n_docs = len(signatures)
+    rng = np.random.default_rng(0)
+    multipliers = rng.integers(1, 2**63, size=rows, dtype=np.uint64) | np.uint64(1)
+    pairs = []
+    for band in range(bands):
+        band_values = signatures[:, band * rows : (band + 1) * rows].astype(np.uint64)
+        keys = (band_values * multipliers).sum(axis=1, dtype=np.uint64)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        group_start = np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]])
+        representative = order[
+            np.maximum.accumulate(np.where(group_start, np.arange(n_docs), 0))
+        ]
+        linked = order != representative
+        pairs.append(np.stack([order[linked], representative[linked]], axis=1))
+    if len(pairs) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.concatenate(pairs)
+
+
+def connected_components(n_nodes: int, edges: np.ndarray) -> np.ndarray:
+    """Label each node with the smallest node id in its connected component."""
+    labels = np.arange(n_nodes)
+    if len(edges) == 0:
+        return labels
+    u, v = edges[:, 0], edges[:, 1]
+    while True:
+        lu, lv = labels[u], labels[v]
+        if (lu == lv).all():
+            return labels
+        np.minimum.at(labels, np.maximum(lu, lv), np.minimum(lu, lv))
+        # Pointer jumping until every node points directly at its root
+        while True:
+            jumped = labels[labels]
+            if (jumped == labels).all():
+                break
+            labels = jumped
+
+
+def near_duplicate_clusters(
+    texts: pd.Series,
+    threshold: float = 0.8,
+    num_perm: int = 128,
+    shingle_size: int = 5,
+    seed: int = 42,
+) -> np.ndarray:
+    """
+    Group texts whose estimated Jaccard similarity of shingles is at least
+    `threshold`. Returns, for each text, the position of the first text of its
+    cluster.
+    """
+    if len(texts) == 0:
+        return np.empty(0, dtype=np.int64)
+    signatures = minhash_signatures(texts, num_perm, shingle_size, seed)
+    bands, rows = optimal_bands(num_perm, threshold)
+    pairs = lsh_candidate_pairs(signatures, bands, rows)
+    # Drop LSH false positives using the signature estimate of Jaccard similarity
+    similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+    pairs = pairs[similarity >= threshold]
+    return connected_components(len(texts), pairs)
@@ -0,0 +1,82 @@
+import atexit
+import multiprocessing
+import threading
+from functools import partial
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+# Partitions handed to each worker, more than one so slow partitions balance out
+PARTITIONS_PER_WORKER = 4
+# The pool can be started from an executor thread while other threads run, and
+# forking a threaded process can deadlock, so workers never start by forking
+START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+_pool = None
+_pool_size = 0
+# Chunks processed on several threads share the pool
+_pool_lock = threading.Lock()
+
+
+def get_pool(n_workers: int):
+    """Return a process pool with `n_workers` workers, reused between stages."""
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None or _pool_size != n_workers:
+            shutdown_pool()
+            _pool = multiprocessing.get_context(START_METHOD).Pool(n_workers)
+            _pool_size = n_workers
+        return _pool
+
+
+def shutdown_pool() -> None:
+    """Close the shared process pool if one has been started."""
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+        _pool_size = 0
+
+
+atexit.register(shutdown_pool)
+
+
+def partition_series(series: pd.Series, n_partitions: int) -> list[pd.Series]:
+    """Split a Series into at most `n_partitions` contiguous partitions."""
+    n_partitions = max(1, min(n_partitions, len(series)))
+    bounds = np.linspace(0, len(series), n_partitions + 1, dtype=int)
+    return [series.iloc[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def map_partitions(
+    series: pd.Series, func: Callable[[pd.Series], pd.Series], n_workers: int = 1
+) -> pd.Series:
+    """
+    Apply a Series -> Series function to contiguous partitions of `series` across
+    worker processes. Partitions are reassembled in their original order, so the
+    result is identical to `func(series)` for row-wise functions.
+    """
+    if n_workers <= 1 or len(series) <= 1:
+        return func(series)
+    partitions = partition_series(series, n_workers * PARTITIONS_PER_WORKER)
+    results = get_pool(n_workers).map(func, partitions)
+    return pd.concat(results)
+
+
+def _transform_partition(partition: pd.Series, func: Callable) -> pd.Series:
+    return partition.transform(func)
+
+
+def parallel_transform(
+    series: pd.Series, func: Callable, n_workers: int = 1
+) -> pd.Series:
+    """Element-wise `series.transform(func)` spread across worker processes."""
+    if n_workers <= 1:
+        return series.transform(func)
+    return map_partitions(
+        series, partial(_transform_partition, func=func), n_workers=n_workers
+    )
@@ -0,0 +1,120 @@
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import backends
+
+if TYPE_CHECKING:
+    from presidio_analyzer import AnalyzerEngine, RecognizerResult
+    from presidio_anonymizer import AnonymizerEngine
+
+# Entities the regex pre-screen looks for. When pre-screening, Presidio is only
+# asked for these, since rows without a regex match are never analysed.
+PRESCREEN_ENTITIES = ["EMAIL_ADDRESS", "PHONE_NUMBER", "IP_ADDRESS", "CREDIT_CARD"]
+# Patterns are deliberately loose: a false candidate only costs a Presidio call.
+# They are matched with Arrow's RE2 kernel, where \d, \w and \b are ASCII-only.
+PRESCREEN_PATTERN = "|".join(
+    [
+        # Email addresses
+        r"[\w.+-]+@[\w-]+\.[\w.-]+",
+        # Phone numbers: seven or more digits with optional separators
+        r"\+?\(?\d{1,4}\)?[\s.-]?\d{2,4}[\s.-]?\d{3,4}",
+        # IPv4 and IPv6 addresses
+        r"\b(?:\d{1,3}\.){3}\d{1,3}\b",
+        r"\b(?:[0-9a-fA-F]{1,4}:){2,7}[0-9a-fA-F]{0,4}",
+        # Card numbers: 13 to 19 digits with optional spaces or dashes
+        r"\b(?:\d[ -]?){12,18}\d\b",
+    ]
+)
+
+
+@lru_cache(maxsize=None)
+def get_analyser() -> "AnalyzerEngine":
+    """Build the Presidio analyser, and load its spaCy model, once per process."""
+    return backends.load("presidio_analyzer").AnalyzerEngine()
+
+
+@lru_cache(maxsize=None)
+def get_anonymiser() -> "AnonymizerEngine":
+    return backends.load("presidio_anonymizer").AnonymizerEngine()
+
+
+def prescreen_pii(texts: pd.Series) -> pd.Series:
+    """Flag texts matching any of the pre-screen patterns, in one Arrow kernel call."""
+    matches = pc.match_substring_regex(
+        pa.array(texts, type=pa.string(), from_pandas=True), PRESCREEN_PATTERN
+    )
+    return pd.Series(
+        matches.fill_null(False).to_numpy(zero_copy_only=False),
+        index=texts.index,
+        dtype=bool,
+    )
+
+
+def summarise_results(results: list["RecognizerResult"]) -> tuple[str, str]:
+    """
+    Reduce Presidio results to the sorted, "|"-separated entity types and the
+    "TYPE:start:end" spans in text order.
+    """
+    results = sorted(results, key=lambda x: (x.start, x.end))
+    entity_types = "|".join(sorted({x.entity_type for x in results}))
+    spans = "|".join(f"{x.entity_type}:{x.start}:{x.end}" for x in results)
+    return entity_types, spans
+
+
+def analyse_pii(
+    texts: pd.Series,
+    mask: bool = False,
+    prescreen: bool = False,
+    entities: list[str] | None = None,
+    n_process: int = 4,
+    batch_size: int = 100,
+    shard_size: int = 10_000,
+    language: str = "en",
+) -> pd.DataFrame:
+    """
+    Run Presidio over the texts, or only over the pre-screened candidates, one
+    shard at a time so that only a shard's recogniser results are kept in memory.
+    Returns `has_pii`, `pii_entity_types` and `pii_spans` columns, plus the
+    masked `text` if `mask` is set.
+    """
+    if prescreen:
+        candidates = prescreen_pii(texts)
+        entities = entities or PRESCREEN_ENTITIES
+    else:
+        candidates = pd.Series(True, index=texts.index)
+    print(f"\tAnalysing {candidates.sum()} of {len(texts)} texts with Presidio")
+
+    output = pd.DataFrame(
+        {"has_pii": False, "pii_entity_types": "", "pii_spans": ""},
+        index=texts.index,
+    )
+    if mask:
+        output.loc[:, "text"] = texts
+
+    batch_analyser = backends.load("presidio_analyzer").BatchAnalyzerEngine(
+        analyzer_engine=get_analyser()
+    )
+    candidate_texts = texts[candidates]
+    for start in range(0, len(candidate_texts), shard_size):
+        shard = candidate_texts.iloc[start : start + shard_size]
+        results = batch_analyser.analyze_iterator(
+            shard.to_list(),
+            language=language,
+            entities=entities,
+            n_process=n_process,
+            batch_size=batch_size,
+        )
+        summaries = [summarise_results(x) for x in results]
+        output.loc[shard.index, "has_pii"] = [len(x) > 0 for x in results]
+        output.loc[shard.index, "pii_entity_types"] = [x[0] for x in summaries]
+        output.loc[shard.index, "pii_spans"] = [x[1] for x in summaries]
+        if mask:
+            output.loc[shard.index, "text"] = [
+                get_anonymiser().anonymize(text, x).text if len(x) > 0 else text
+                for text, x in zip(shard, results)
+            ]
+    return output
@@ -0,0 +1,114 @@
+import enum
+from dataclasses import dataclass, field
+from typing import Callable
+
+import pandas as pd
+
+from checkpoint import Checkpoint
+from profiling import PipelineProfiler
+
+
+class CostClass(enum.IntEnum):
+    CHEAP = 0  # Vectorised column operations
+    MODERATE = 1  # Pure-Python work per row
+    EXPENSIVE = 2  # Parsing or model inference per row
+
+
+@dataclass
+class Stage:
+    """
+    A pipeline step together with what the planner needs to know to move it:
+    its cost, the columns it reads and writes, whether it removes rows, and
+    whether each row's result depends on that row alone.
+    """
+
+    name: str
+    func: Callable[..., pd.DataFrame]
+    cost: CostClass
+    reads: tuple[str, ...] = ()
+    writes: tuple[str, ...] = ()
+    kwargs: dict = field(default_factory=dict)
+    filters: bool = False
+    row_local: bool = True
+    enabled: bool = True
+
+    def run(self, data: pd.DataFrame) -> pd.DataFrame:
+        return self.func(data, **self.kwargs)
+
+
+def must_precede(first: Stage, second: Stage) -> bool:
+    """Check whether `first`, declared before `second`, has to run before it."""
+    # Reading a column written by the other stage, or both writing the same one
+    if set(second.reads) & set(first.writes):
+        return True
+    if set(first.reads) & set(second.writes):
+        return True
+    if set(first.writes) & set(second.writes):
+        return True
+    # Whole-frame stages see other rows, so no filter can move across them
+    if not first.row_local and (second.filters or not second.row_local):
+        return True
+    if not second.row_local and first.filters:
+        return True
+    return False
+
+
+def plan_stages(stages: list[Stage]) -> list[Stage]:
+    """
+    Order enabled stages so that, of the stages whose dependencies have run,
+    the cheapest filter runs next, and other stages only once no filter is
+    ready, so they see as few rows as possible. Stages only move past stages
+    they do not depend on, so the result matches running them in declaration
+    order.
+    """
+    stages = [stage for stage in stages if stage.enabled]
+    depends_on = {
+        j: {i for i in range(j) if must_precede(stages[i], stages[j])}
+        for j in range(len(stages))
+    }
+    planned: list[int] = []
+    while len(planned) < len(stages):
+        ready = [
+            j
+            for j in range(len(stages))
+            if j not in planned and depends_on[j] <= set(planned)
+        ]
+        planned.append(
+            min(ready, key=lambda j: (not stages[j].filters, stages[j].cost, j))
+        )
+    return [stages[j] for j in planned]
+
+
+def column_order(columns: pd.Index, stages: list[Stage]) -> list[str]:
+    """Return the column order produced by running the stages as declared."""
+    order = list(columns)
+    for stage in stages:
+        order.extend(column for column in stage.writes if column not in order)
+    return order
+
+
+def run_pipeline(
+    data: pd.DataFrame,
+    stages: list[Stage],
+    profiler: PipelineProfiler | None = None,
+    reorder: bool = True,
+    checkpoint: Checkpoint | None = None,
+) -> pd.DataFrame:
+    """
+    Run the stages over a DataFrame, cheapest filters first if `reorder` is set.
+    With a checkpoint, the DataFrame is saved after every stage and a resumed
+    run starts after the last saved stage.
+    """
+    order = column_order(data.columns, stages)
+    planned = plan_stages(stages) if reorder else [s for s in stages if s.enabled]
+    start = 0
+    if checkpoint is not None:
+        start, restored = checkpoint.restore_stages([s.name for s in planned])
+        data = restored if restored is not None else data
+    for stage in planned[start:]:
+        run = profiler.wrap(stage.name, stage.run) if profiler else stage.run
+        data = run(data)
+        if checkpoint is not None:
+            checkpoint.save_stage(stage.name, data)
+    columns = [column for column in order if column in data.columns]
+    return data[columns + [c for c in data.columns if c not in columns]]
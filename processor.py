@@ -1,31 +1,56 @@
 import enum
 import re
-from urllib.parse import urlparse
+import threading
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING
 
 import pandas as pd
-from bs4 import BeautifulSoup
-from langdetect import DetectorFactory, detect_langs
-from lingua import LanguageDetectorBuilder, Language
-from pygments.lexers import guess_lexer
-from presidio_analyzer import AnalyzerEngine, BatchAnalyzerEngine
-from presidio_anonymizer import BatchAnonymizerEngine
-from tokeniser import tokenise_nltk, tokenise_spacy, tokenise_tiktoken
+import backends
+from cache import ResultCache, cached_apply
+from codedetect import detect_code
+from dedup_index import DedupIndex, hash_rows
+from domains import DomainPolicy, DomainQuota, normalise_hosts
+from htmlclean import HtmlEngine, strip_html
+from minhash import near_duplicate_clusters
+from parallel import map_partitions, parallel_transform
+from pii import analyse_pii
+import textops
+from tokeniser import count_tokens, encode_tokens
 
-DetectorFactory.seed = 0
+if TYPE_CHECKING:
+    from lingua import LanguageDetector
+
+# Chunks processed on several threads may load langdetect at the same time
+_langdetect_lock = threading.Lock()
 
 
 class LanguageTool(enum.Enum):
     LINGUA = "lingua"
+    LINGUA_CASCADE = "lingua_cascade"
     LANGDETECT = "langdetect"
 
 
 def deduplicate_data(
-    data: pd.DataFrame, fields: list[str] = ["text", "url"], apply_filter: bool = False
+    data: pd.DataFrame,
+    fields: list[str] = ["text", "url"],
+    apply_filter: bool = False,
+    index: DedupIndex | None = None,
+    keep_original: bool = True,
 ) -> pd.DataFrame:
-    """Remove duplicate rows from the DataFrame."""
+    """
+    Remove duplicate rows from the DataFrame. With a dedup index, rows are also
+    duplicates of rows seen in earlier chunks, runs or the reference indexes.
+    The unstripped text is kept in 'text_original' if `keep_original` is set.
+    """
     print("Deduplicating data...")
-    data.loc[:, "duplicate"] = data.duplicated(subset=fields)
-    data.loc[:, "text_original"] = data.loc[:, "text"]
+    if index is None:
+        data.loc[:, "duplicate"] = data.duplicated(subset=fields)
+    else:
+        digests = hash_rows(data, fields, index.digest_bits)
+        data.loc[:, "duplicate"] = index.check_and_add(digests)
+        print(f"\t{len(index)} rows in the dedup index")
+    if keep_original:
+        data.loc[:, "text_original"] = data.loc[:, "text"]
     data.loc[:, "text"] = data.loc[:, "text"].str.strip()
     if apply_filter:
         print("\tDuplicates filtered")
@@ -33,71 +58,238 @@ def deduplicate_data(
     return data
 
 
+def deduplicate_near_data(
+    data: pd.DataFrame,
+    threshold: float = 0.8,
+    num_perm: int = 128,
+    shingle_size: int = 5,
+    apply_filter: bool = False,
+) -> pd.DataFrame:
+    """
+    Cluster near-duplicate texts with MinHash signatures and LSH banding. Each row
+    is labelled with the index of the first row of its cluster.
+    """
+    print("Detecting near-duplicates...")
+    clusters = near_duplicate_clusters(
+        data.loc[:, "text"],
+        threshold=threshold,
+        num_perm=num_perm,
+        shingle_size=shingle_size,
+    )
+    data.loc[:, "near_duplicate_cluster"] = data.index[clusters]
+    if apply_filter:
+        print(f"\tNear-duplicates with similarity >= {threshold} filtered")
+        data = data[data["near_duplicate_cluster"] == data.index]
+    return data
+
+
 def extract_domain(url: str) -> str | None:
-    """Extract the domain from a given URL."""
-    try:
-        parsed_url = urlparse(url)
-        return parsed_url.__getattribute__("netloc")
-    except Exception:
-        return None
+    """Extract the normalised host from a given URL, as `extract_domain_from_col` does."""
+    return normalise_hosts(pd.Series([url], dtype=object)).iloc[0]
 
 
-def extract_domain_from_col(data: pd.DataFrame, filter_github=True) -> pd.DataFrame:
+def extract_domain_from_col(
+    data: pd.DataFrame, filter_github=True, policy: DomainPolicy | None = None
+) -> pd.DataFrame:
     """
-    Extract the domain from the 'url' column of the DataFrame and add it as a new column.
+    Extract the normalised host from the 'url' column of the DataFrame and add it
+    as a new 'domain' column, dropping rows the domain `policy` blocks.
     """
     print("Extracting domain from URL...")
-    data.loc[:, "domain"] = data.loc[:, "url"].transform(extract_domain)
+    data.loc[:, "domain"] = normalise_hosts(data.loc[:, "url"])
     if filter_github:
         data = data[data["domain"] != "github.com"]
+    if policy is not None:
+        allowed = policy.allowed(data["domain"])
+        print(f"\t{(~allowed).sum()} rows from blocked domains filtered")
+        data = data[allowed]
     return data
 
 
+def cap_domain_docs(data: pd.DataFrame, quota: DomainQuota) -> pd.DataFrame:
+    """Keep at most `quota.max_docs` rows per domain, counting across chunks."""
+    print(f"Capping documents at {quota.max_docs} per domain...")
+    keep = quota.within_quota(data["domain"])
+    print(f"\t{(~keep).sum()} rows over their domain's quota filtered")
+    return data[keep]
+
+
+@lru_cache(maxsize=None)
+def get_lingua_detector(
+    iso_codes: tuple[str, ...] | None = None,
+) -> "LanguageDetector":
+    """Build a lingua detector for the given ISO 639-1 codes (all languages if None)."""
+    lingua = backends.load("lingua")
+    if iso_codes is None:
+        return lingua.LanguageDetectorBuilder.from_all_languages().build()
+    return lingua.LanguageDetectorBuilder.from_iso_codes_639_1(
+        *[getattr(lingua.IsoCode639_1, code.upper()) for code in iso_codes]
+    ).build()
+
+
+@lru_cache(maxsize=None)
+def load_langdetect():
+    """Import langdetect, seeding it so results are reproducible, once per process."""
+    with _langdetect_lock:
+        langdetect = backends.load("langdetect")
+        langdetect.DetectorFactory.seed = 0
+        # langdetect loads its profiles on first use without a lock, so threads
+        # detecting at once could see a half-loaded factory; load them here
+        langdetect.detector_factory.init_factory()
+    return langdetect
+
+
+def detect_languages_lingua(texts: pd.Series) -> pd.DataFrame:
+    """Detect languages with lingua, with the confidence that each text is English."""
+    # NOTE Dataframe level operation (already parallised inside the library)
+    detector = get_lingua_detector()
+    languages = detector.detect_languages_in_parallel_of(texts.to_list())
+    return pd.DataFrame(
+        {
+            # Convert to ISO 639-1 codes
+            "detected_language_lang": [
+                x.iso_code_639_1.name if x is not None else None for x in languages
+            ],
+            # Calculate English confidence
+            "detected_language_prob": detector.compute_language_confidence_in_parallel(
+                texts.to_list(), backends.load("lingua").Language.ENGLISH
+            ),
+        },
+        index=texts.index,
+    )
+
+
+def in_fallback_band(
+    probs: pd.Series, en_threshold: float, fallback_margin: float
+) -> pd.Series:
+    """
+    Check which English confidences lie strictly within `fallback_margin` of
+    `en_threshold`. The bounds are compared directly rather than through
+    `abs(prob - en_threshold)`, whose rounding puts 1.0 inside a 0.9 +/- 0.1 band.
+    """
+    return (probs > en_threshold - fallback_margin) & (
+        probs < en_threshold + fallback_margin
+    )
+
+
+def detect_languages_lingua_cascade(
+    texts: pd.Series,
+    candidate_languages: tuple[str, ...] = ("en", "de", "fr", "es", "it", "pt", "nl"),
+    sample_chars: int = 1000,
+    en_threshold: float = 0.9,
+    fallback_margin: float = 0.1,
+) -> pd.DataFrame:
+    """
+    Detect languages with lingua on the first `sample_chars` characters of each
+    text, restricted to the candidate languages. The top language and English
+    confidence come from a single pass over the confidence values. Texts whose
+    English confidence lands within `fallback_margin` of `en_threshold` are
+    detected again over their full text and all languages.
+    """
+    if "en" not in candidate_languages:
+        candidate_languages = ("en", *candidate_languages)
+    detector = get_lingua_detector(tuple(candidate_languages))
+    english = backends.load("lingua").Language.ENGLISH
+    confidences = detector.compute_language_confidence_values_in_parallel(
+        texts.str.slice(0, sample_chars).to_list()
+    )
+    languages, en_probs = [], []
+    for values in confidences:
+        top = values[0] if len(values) > 0 and values[0].value > 0 else None
+        languages.append(top.language.iso_code_639_1.name if top else None)
+        en_probs.append(next((x.value for x in values if x.language == english), 0.0))
+    detected = pd.DataFrame(
+        {"detected_language_lang": languages, "detected_language_prob": en_probs},
+        index=texts.index,
+    )
+
+    ambiguous = in_fallback_band(
+        detected["detected_language_prob"], en_threshold, fallback_margin
+    )
+    if ambiguous.any():
+        print(f"\tFalling back to full detection for {ambiguous.sum()} texts")
+        detected.loc[ambiguous, :] = detect_languages_lingua(texts[ambiguous])
+    return detected
+
+
+def detect_languages_langdetect(texts: pd.Series, n_workers: int = 1) -> pd.DataFrame:
+    """Detect languages with langdetect, with the probability of the top language."""
+    detected = parallel_transform(texts, detect_langs_safe, n_workers=n_workers)
+    return pd.DataFrame(
+        {
+            "detected_language_lang": detected.transform(
+                lambda x: x.lang if x is not None else None
+            ),
+            "detected_language_prob": detected.transform(
+                lambda x: x.prob if x is not None else None
+            ),
+        },
+        index=texts.index,
+    )
+
+
 def extract_language(
     data: pd.DataFrame,
     tool: LanguageTool = LanguageTool.LANGDETECT,
     en_only: bool = False,
     en_threshold: float = 0.9,
+    n_workers: int = 1,
+    cache: ResultCache | None = None,
+    candidate_languages: tuple[str, ...] = ("en", "de", "fr", "es", "it", "pt", "nl"),
+    sample_chars: int = 1000,
+    fallback_margin: float = 0.1,
 ) -> pd.DataFrame:
     """
     Detect the language of the text in the DataFrame and add it as a new column.
     """
     print("Extracting language...")
     print(f"\tUsing tool: {tool.value}")
-    if tool == LanguageTool.LINGUA:
-        # NOTE Dataframe level operation (already parallised inside the library)
-        detector = LanguageDetectorBuilder.from_all_languages().build()
-        data.loc[:, "detected_language_lang"] = (
-            detector.detect_languages_in_parallel_of(data.loc[:, "text"])
-        )
-
-        # Convert to ISO 639-1 codes
-        data.loc[:, "detected_language_lang"] = data.loc[
-            :, "detected_language_lang"
-        ].transform(lambda x: x.iso_code_639_1.name)
-
-        # Calculate English confidence
-        data.loc[:, "detected_language_prob"] = (
-            detector.compute_language_confidence_in_parallel(
-                data.loc[:, "text"], Language.ENGLISH
+    columns = ["detected_language_lang", "detected_language_prob"]
+    if tool in [LanguageTool.LINGUA, LanguageTool.LINGUA_CASCADE]:
+        if tool == LanguageTool.LINGUA:
+            params = {"tool": tool.value}
+            detect = detect_languages_lingua
+        else:
+            params = {
+                "tool": tool.value,
+                "candidate_languages": list(candidate_languages),
+                "sample_chars": sample_chars,
+                "en_threshold": en_threshold,
+                "fallback_margin": fallback_margin,
+            }
+            detect = partial(
+                detect_languages_lingua_cascade,
+                candidate_languages=tuple(candidate_languages),
+                sample_chars=sample_chars,
+                en_threshold=en_threshold,
+                fallback_margin=fallback_margin,
             )
+        detected = cached_apply(
+            cache, data.loc[:, "text"], "extract_language", params, detect, columns
         )
+        for column in columns:
+            data.loc[:, column] = detected[column]
         if en_only:
             data = data[
                 (data["detected_language_lang"] == "EN")
                 & (data["detected_language_prob"] >= en_threshold)
             ]
     elif tool == LanguageTool.LANGDETECT:
-        # TODO: Parallelize this operation for better performance on large datasets
-        data.loc[:, "detected_language"] = data.loc[:, "text"].transform(
-            detect_langs_safe
+        detected = cached_apply(
+            cache,
+            data.loc[:, "text"],
+            "extract_language",
+            {"tool": tool.value},
+            partial(detect_languages_langdetect, n_workers=n_workers),
+            columns,
         )
-        data.loc[:, "detected_language_lang"] = data.loc[
-            :, "detected_language"
-        ].transform(lambda x: x.lang if x is not None else None)
-        data.loc[:, "detected_language_prob"] = data.loc[
-            :, "detected_language"
-        ].transform(lambda x: x.prob if x is not None else None)
+        langdetect_language = backends.load("langdetect.language").Language
+        data.loc[:, "detected_language"] = [
+            langdetect_language(lang, prob) if lang is not None else None
+            for lang, prob in detected.itertuples(index=False)
+        ]
+        for column in columns:
+            data.loc[:, column] = detected[column]
 
         if en_only:
             print(f"\tFiltering non-English texts with probability < {en_threshold}...")
@@ -111,7 +303,7 @@ def extract_language(
 def detect_langs_safe(text: str) -> str | None:
     """Detect the language of the given text safely."""
     try:
-        langs = detect_langs(text)
+        langs = load_langdetect().detect_langs(text)
         if len(langs) > 0:
             return langs[0]
         return None
@@ -125,10 +317,12 @@ def clean_ascii(text: str) -> str:
     return "".join(c for c in text if (c.isprintable() or c in ["\n", "\r", "\t"]))
 
 
-def clean_text_ascii(data: pd.DataFrame) -> pd.DataFrame:
+def clean_text_ascii(data: pd.DataFrame, n_workers: int = 1) -> pd.DataFrame:
     """Apply ASCII cleaning to the 'text' column of the DataFrame."""
     print("Cleaning ASCII characters...")
-    data.loc[:, "text"] = data.loc[:, "text"].transform(clean_ascii)
+    data.loc[:, "text"] = map_partitions(
+        data.loc[:, "text"], textops.clean_ascii, n_workers=n_workers
+    )
     return data
 
 
@@ -138,11 +332,13 @@ def check_any_alphabetic(text: str) -> bool:
 
 
 def check_text_is_alphabetic(
-    data: pd.DataFrame, apply_filter: bool = False
+    data: pd.DataFrame, apply_filter: bool = False, n_workers: int = 1
 ) -> pd.DataFrame:
     """Add a column indicating if the 'text' contains any alphabetic characters."""
     print("Checking if text has alphabetic characters...")
-    data.loc[:, "has_alphabetic"] = data.loc[:, "text"].transform(check_any_alphabetic)
+    data.loc[:, "has_alphabetic"] = map_partitions(
+        data.loc[:, "text"], textops.has_alphabetic, n_workers=n_workers
+    )
     if apply_filter:
         print("\tNon-alphabetic text filtered")
         data = data[data["has_alphabetic"]]
@@ -163,7 +359,7 @@ def check_hyperlink(text: str) -> bool:
 def check_is_code(text: str) -> bool:
     """Check if the text is code by attempting to guess its lexer."""
     try:
-        lexer = guess_lexer(text)
+        lexer = backends.load("pygments.lexers").guess_lexer(text)
         # If the guessed lexer is not a TextLexer, we consider it as code
         return lexer.name
     except Exception as e:
@@ -171,22 +367,43 @@ def check_is_code(text: str) -> bool:
         return False
 
 
-def check_text_is_code(data: pd.DataFrame, apply_filter: bool = False) -> pd.DataFrame:
-    """Add a column indicating if the 'text' is code."""
+def check_text_is_code(
+    data: pd.DataFrame,
+    apply_filter: bool = False,
+    n_workers: int = 1,
+    threshold: float = 0.4,
+    margin: float = 0.1,
+    prefix_chars: int = 2000,
+) -> pd.DataFrame:
+    """
+    Add columns with a score of how much the 'text' looks like code, and whether
+    it is code. Only texts scoring within `margin` of `threshold` are passed to
+    pygments' `guess_lexer`.
+    """
     print("Checking if text is code...")
-    data.loc[:, "is_code"] = data.loc[:, "text"].transform(check_is_code)
+    detected = detect_code(
+        data.loc[:, "text"],
+        threshold=threshold,
+        margin=margin,
+        prefix_chars=prefix_chars,
+        map_func=partial(map_partitions, n_workers=n_workers),
+    )
+    data.loc[:, "is_code"] = detected["is_code"]
+    data.loc[:, "code_score"] = detected["code_score"]
     if apply_filter:
         print("\tCode text filtered")
-        data = data[~(data["is_code"] == "Text only")]
+        data = data[~data["is_code"]]
     return data
 
 
 def check_text_is_hyperlink(
-    data: pd.DataFrame, apply_filter: bool = False
+    data: pd.DataFrame, apply_filter: bool = False, n_workers: int = 1
 ) -> pd.DataFrame:
     """Add a column indicating if the 'text' contains a hyperlink."""
     print("Checking if text is a hyperlink...")
-    data.loc[:, "is_hyperlink"] = data.loc[:, "text"].transform(check_hyperlink)
+    data.loc[:, "is_hyperlink"] = map_partitions(
+        data.loc[:, "text"], textops.is_hyperlink, n_workers=n_workers
+    )
     if apply_filter:
         print("\tHyperlink text filtered")
         data = data[~data["is_hyperlink"]]
@@ -195,22 +412,38 @@ def check_text_is_hyperlink(
 
 def clean_html(text: str) -> str:
     """Remove HTML tags from the text."""
-    return BeautifulSoup(text).get_text()
+    return backends.load("bs4").BeautifulSoup(text, "lxml").get_text()
 
 
-def clean_text_html(data: pd.DataFrame) -> pd.DataFrame:
+def clean_text_html(
+    data: pd.DataFrame, n_workers: int = 1, engine: HtmlEngine = HtmlEngine.LXML
+) -> pd.DataFrame:
     """Apply HTML cleaning to the 'text' column of the DataFrame."""
     print("Cleaning HTML tags...")
-    data.loc[:, "text"] = data.loc[:, "text"].transform(clean_html)
+    print(f"\tUsing engine: {engine.value}")
+    data.loc[:, "text"] = map_partitions(
+        data.loc[:, "text"], partial(strip_html, engine=engine), n_workers=n_workers
+    )
     return data
 
 
+def prefilter_short_length(
+    data: pd.DataFrame, min_text_length: int = 20
+) -> pd.DataFrame:
+    """
+    Drop rows already shorter than `min_text_length` before any cleaning. The
+    cleaners only ever remove characters, so these rows cannot pass
+    `clean_short_length` later on.
+    """
+    return data[data.loc[:, "text"].str.len() >= min_text_length]
+
+
 def clean_short_length(
     data: pd.DataFrame, min_text_length: int = 20, min_word_count: int = 10
 ) -> pd.DataFrame:
     """Remove rows with 'text' shorter than the specified minimum length."""
     data.loc[:, "text_length"] = data.loc[:, "text"].str.len()
-    data.loc[:, "word_length"] = data.loc[:, "text"].str.split(" ").str.len()
+    data.loc[:, "word_length"] = textops.count_words(data.loc[:, "text"])
     data = data[
         (data["text_length"] >= min_text_length)
         & (data["word_length"] >= min_word_count)
@@ -218,37 +451,75 @@ def clean_short_length(
     return data
 
 
-def detect_pii(data: pd.DataFrame, mask: bool = False) -> pd.DataFrame:
-    """Detect if the text contains PII (e.g., email addresses, phone numbers)."""
-    analyser = AnalyzerEngine()
-    batch_analyser = BatchAnalyzerEngine(analyzer_engine=analyser)
-    batch_anonymizer = BatchAnonymizerEngine()
-    data.loc[:, "has_pii"] = list(
-        batch_analyser.analyze_iterator(
-            data.loc[:, "text"].to_list(), language="en", n_process=4, batch_size=100
-        )
+def detect_pii(
+    data: pd.DataFrame,
+    mask: bool = False,
+    cache: ResultCache | None = None,
+    prescreen: bool = False,
+    entities: list[str] | None = None,
+    n_process: int = 4,
+    batch_size: int = 100,
+    shard_size: int = 10_000,
+) -> pd.DataFrame:
+    """
+    Detect if the text contains PII (e.g., email addresses, phone numbers), and
+    which entity types and character spans were found.
+    """
+    columns = ["has_pii", "pii_entity_types", "pii_spans"]
+    columns = columns + ["text"] if mask else columns
+    detected = cached_apply(
+        cache,
+        data.loc[:, "text"],
+        "detect_pii",
+        {"mask": mask, "prescreen": prescreen, "entities": entities},
+        partial(
+            analyse_pii,
+            mask=mask,
+            prescreen=prescreen,
+            entities=entities,
+            n_process=n_process,
+            batch_size=batch_size,
+            shard_size=shard_size,
+        ),
+        columns,
     )
-    if mask:
-        data.loc[:, "text"] = list(
-            batch_anonymizer.anonymize_list(
-                data.loc[:, "text"].to_list(),
-                data.loc[:, "has_pii"].to_list(),
-            )
-        )
-    data.loc[:, "has_pii"] = data.loc[:, "has_pii"].transform(lambda x: len(x) > 0)
+    for column in columns:
+        data.loc[:, column] = detected[column]
     return data
 
 
-def tokenise_texts(data: pd.DataFrame, method: str = "tiktoken") -> pd.DataFrame:
-    """Tokenise the 'text' column using different tokenisation methods."""
+def tokenise_texts(
+    data: pd.DataFrame,
+    method: str = "tiktoken",
+    cache: ResultCache | None = None,
+    keep_ids: bool = False,
+) -> pd.DataFrame:
+    """
+    Tokenise the 'text' column using different tokenisation methods. With
+    `keep_ids`, the tiktoken ids of each text are kept in 'token_ids'.
+    """
     print("Tokenising texts...")
     assert method in ["spacy", "nltk", "tiktoken"], (
         "Invalid tokenisation method, choose from 'spacy', 'nltk', 'tiktoken'"
     )
-    if method == "spacy":
-        data.loc[:, "token_count"] = data.loc[:, "text"].transform(tokenise_spacy)
-    elif method == "nltk":
-        data.loc[:, "token_count"] = data.loc[:, "text"].transform(tokenise_nltk)
-    elif method == "tiktoken":
-        data.loc[:, "token_count"] = data.loc[:, "text"].transform(tokenise_tiktoken)
+    if keep_ids:
+        assert method == "tiktoken", "Token ids can only be kept with tiktoken"
+        # Ids are too large to cache, so every text is encoded
+        ids = encode_tokens(data.loc[:, "text"].to_list())
+        data.loc[:, "token_count"] = pd.Series(
+            [len(tokens) for tokens in ids], index=data.index, dtype="int64"
+        )
+        data["token_ids"] = pd.Series(ids, index=data.index, dtype=object)
+        return data
+    data.loc[:, "token_count"] = cached_apply(
+        cache,
+        data.loc[:, "text"],
+        "tokenise_texts",
+        {"method": method},
+        lambda texts: pd.DataFrame(
+            {"token_count": count_tokens(texts.to_list(), method=method)},
+            index=texts.index,
+        ),
+        ["token_count"],
+    )["token_count"]
     return data
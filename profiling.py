@@ -0,0 +1,177 @@
+import cProfile
+import json
+import resource
+import sys
+import threading
+import time
+from functools import wraps
+from typing import Callable
+
+import pandas as pd
+
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def peak_rss() -> int:
+    """Return the peak resident set size of this process in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+
+
+def text_bytes(data: pd.DataFrame) -> int:
+    """Return the UTF-8 size of the 'text' column in bytes."""
+    if "text" not in data.columns or len(data) == 0:
+        return 0
+    return int(data["text"].str.encode("utf-8", "surrogatepass").str.len().sum())
+
+
+class PipelineProfiler:
+    """
+    Record wall time, row counts, throughput, peak RSS growth and text volume of
+    each pipeline stage. Stages that run more than once, such as once per chunk
+    in streaming mode, are aggregated under their name.
+    """
+
+    def __init__(self, profile_stage: str | None = None):
+        self.profile_stage = profile_stage
+        self.profile = cProfile.Profile() if profile_stage is not None else None
+        self.stages: dict[str, dict] = {}
+        self.memory: dict[str, dict] = {}
+        self.executor: dict = {}
+        self.started = time.perf_counter()
+        # Chunks can be processed on several threads at once
+        self.lock = threading.Lock()
+
+    def wrap(self, name: str, func: Callable[..., pd.DataFrame]) -> Callable:
+        """Wrap a `DataFrame -> DataFrame` stage so each call is recorded."""
+
+        @wraps(func)
+        def profiled(data: pd.DataFrame, *args, **kwargs) -> pd.DataFrame:
+            rows_in, bytes_in = len(data), text_bytes(data)
+            rss_before = peak_rss()
+            start = time.perf_counter()
+            if name == self.profile_stage:
+                # A profiler can only follow one thread at a time
+                with self.lock:
+                    self.profile.enable()
+                    try:
+                        result = func(data, *args, **kwargs)
+                    finally:
+                        self.profile.disable()
+            else:
+                result = func(data, *args, **kwargs)
+            self.record(
+                name,
+                wall_time=time.perf_counter() - start,
+                rows_in=rows_in,
+                rows_out=len(result),
+                text_bytes=bytes_in,
+                peak_rss_delta=peak_rss() - rss_before,
+            )
+            return result
+
+        return profiled
+
+    def record(
+        self,
+        name: str,
+        wall_time: float,
+        rows_in: int,
+        rows_out: int,
+        text_bytes: int,
+        peak_rss_delta: int,
+    ) -> None:
+        with self.lock:
+            stage = self.stages.setdefault(
+                name,
+                {
+                    "calls": 0,
+                    "wall_time_s": 0.0,
+                    "rows_in": 0,
+                    "rows_out": 0,
+                    "text_bytes": 0,
+                    "peak_rss_delta_bytes": 0,
+                },
+            )
+            stage["calls"] += 1
+            stage["wall_time_s"] += wall_time
+            stage["rows_in"] += rows_in
+            stage["rows_out"] += rows_out
+            stage["text_bytes"] += text_bytes
+            stage["peak_rss_delta_bytes"] += peak_rss_delta
+
+    def record_memory(
+        self, name: str, rows: int, bytes_before: int, bytes_after: int
+    ) -> None:
+        """Record the size of a DataFrame before and after compacting it."""
+        with self.lock:
+            memory = self.memory.setdefault(
+                name, {"rows": 0, "bytes_before": 0, "bytes_after": 0}
+            )
+            memory["rows"] += rows
+            memory["bytes_before"] += bytes_before
+            memory["bytes_after"] += bytes_after
+
+    def record_executor(self, stats: dict) -> None:
+        """Record the stage and queue statistics of the pipelined executor."""
+        self.executor = stats
+
+    def report(self) -> dict:
+        """Return the run report as a JSON-serialisable dictionary."""
+        stages = {}
+        for name, stage in self.stages.items():
+            wall_time = stage["wall_time_s"]
+            stages[name] = {
+                **stage,
+                "rows_per_s": stage["rows_in"] / wall_time if wall_time > 0 else None,
+                "text_mb_per_s": stage["text_bytes"] / wall_time / 1e6
+                if wall_time > 0
+                else None,
+            }
+        memory = {
+            name: {
+                **sizes,
+                "bytes_per_row_before": sizes["bytes_before"] / sizes["rows"]
+                if sizes["rows"] > 0
+                else None,
+                "bytes_per_row_after": sizes["bytes_after"] / sizes["rows"]
+                if sizes["rows"] > 0
+                else None,
+            }
+            for name, sizes in self.memory.items()
+        }
+        return {
+            "wall_time_s": time.perf_counter() - self.started,
+            "peak_rss_bytes": peak_rss(),
+            "stages": stages,
+            "memory": memory,
+            "executor": self.executor,
+        }
+
+    def save(self, report_path: str, profile_path: str | None = None) -> None:
+        """Write the run report, and the cProfile stats of the profiled stage."""
+        with open(report_path, "w") as file:
+            json.dump(self.report(), file, indent=4)
+        print(f"Saved run report to {report_path}")
+        if self.profile is not None and profile_path is not None:
+            self.profile.dump_stats(profile_path)
+            print(f"Saved profile of {self.profile_stage} to {profile_path}")
+
+    def print_summary(self) -> None:
+        """Print a table of the time spent in each stage, and the memory per row."""
+        total = sum(stage["wall_time_s"] for stage in self.stages.values())
+        print("Stage timings:")
+        for name, stage in sorted(
+            self.stages.items(), key=lambda item: -item[1]["wall_time_s"]
+        ):
+            share = stage["wall_time_s"] / total if total > 0 else 0.0
+            print(
+                f"\t{name}: {stage['wall_time_s']:.2f}s ({share:.1%}), "
+                f"{stage['rows_in']} -> {stage['rows_out']} rows"
+            )
+        for name, memory in self.report()["memory"].items():
+            if memory["rows"] > 0:
+                print(
+                    f"\t{name} memory: {memory['bytes_per_row_before']:,.0f} -> "
+                    f"{memory['bytes_per_row_after']:,.0f} bytes/row"
+                )
@@ -1,5 +1,15 @@
+import enum
+import hashlib
+
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
+
+import backends
+
+
+class SplitMethod(enum.Enum):
+    RANDOM = "random"
+    HASH = "hash"
 
 
 def split_data(
@@ -10,6 +20,7 @@ def split_data(
     **kwargs,
 ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """Split the DataFrame into training, validation, and test sets."""
+    train_test_split = backends.load("sklearn.model_selection").train_test_split
     train_data, test_data = train_test_split(
         data, test_size=(val_size + test_size), random_state=random_state, **kwargs
     )
@@ -19,3 +30,45 @@ def split_data(
         random_state=random_state,
     )
     return train_data, val_data, test_data
+
+
+def hash_buckets(keys: pd.Series, seed: int = 42) -> np.ndarray:
+    """Map each key, together with the seed, to a uniform number in [0, 1)."""
+    digests = b"".join(
+        hashlib.blake2b(
+            str(key).encode("utf-8", "surrogatepass"),
+            digest_size=8,
+            salt=seed.to_bytes(8, "little", signed=True),
+        ).digest()
+        for key in keys
+    )
+    return np.frombuffer(digests, dtype="<u8") / float(1 << 64)
+
+
+def hash_split(
+    data: pd.DataFrame,
+    test_size: float = 0.2,
+    val_size: float = 0.1,
+    random_state: int = 42,
+    key: str = "text",
+    group_by: str | None = None,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Split the DataFrame into training, validation, and test sets by hashing each
+    row's `key` column with the seed. A row's split depends only on its own key,
+    so rows keep their order and streamed chunks are split as if the dataset
+    were split whole. With `group_by`, e.g. `domain`, all rows sharing a value
+    of that column go to the same split; rows where it is missing or empty fall
+    back to `key`, and rows missing `key` fall back to `text`.
+    """
+    keys = data[key] if key in data.columns else data["text"]
+    keys = keys.where(keys.notna(), data["text"])
+    if group_by is not None:
+        # Compacted frames hold e.g. `domain` as a categorical, whose values
+        # cannot be replaced by keys outside its categories
+        groups = data[group_by].astype(object)
+        keys = groups.where(groups.notna() & (groups != ""), keys)
+    buckets = hash_buckets(keys, random_state)
+    is_test = buckets < test_size
+    is_valid = ~is_test & (buckets < test_size + val_size)
+    return data[~is_test & ~is_valid], data[is_valid], data[is_test]
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from dataio import read_file, read_file_frames
+
+RECORDS = [
+    {
+        "text": "a",
+        "date": "2024-01-02",
+        "ts": "2024-01-02 03:04:05",
+        "meta": {"created_at": "2024-01-02T03:04:05"},
+    },
+    {
+        "text": "b",
+        "date": "2023-12-31",
+        "ts": "2023-12-31 23:59:59",
+        "meta": {"created_at": "2023-12-31T23:59:59"},
+    },
+]
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / "dates.jsonl"
+    path.write_text("".join(json.dumps(record) + "\n" for record in RECORDS))
+    return str(path)
+
+
+def test_read_file_keeps_date_strings(path):
+    data = read_file(path)
+    assert data.to_dict(orient="records") == RECORDS
+
+
+def test_read_file_frames_keeps_date_strings(path):
+    frames = list(read_file_frames(path, batch_size=1))
+    records = [record for frame in frames for record in frame.to_dict("records")]
+    assert records == RECORDS
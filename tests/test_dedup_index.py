@@ -0,0 +1,40 @@
+import numpy as np
+
+from dedup_index import DedupIndex
+
+
+def digests(*values: int) -> np.ndarray:
+    return np.array(values, dtype="<u8")
+
+
+def test_resume_state_rolls_back_later_digests(tmp_path):
+    index = DedupIndex(str(tmp_path), max_memory_entries=2, run="job")
+    index.check_and_add(digests(1, 2, 3))
+    state = index.state()
+    index.check_and_add(digests(4, 5, 6))
+
+    resumed = DedupIndex(
+        str(tmp_path), max_memory_entries=2, run="job", resume_state=state
+    )
+    assert resumed.check_and_add(digests(1, 4)).tolist() == [True, False]
+
+
+def test_rerun_replaces_own_digests(tmp_path):
+    index = DedupIndex(str(tmp_path), run="first")
+    index.check_and_add(digests(1, 2))
+    index.close()
+    index = DedupIndex(str(tmp_path), run="second")
+    index.check_and_add(digests(3))
+    index.close()
+
+    rerun = DedupIndex(str(tmp_path), run="second")
+    assert rerun.check_and_add(digests(1, 3)).tolist() == [True, False]
+
+
+def test_state_does_not_add_segments(tmp_path):
+    index = DedupIndex(str(tmp_path), run="job")
+    for value in range(10):
+        index.check_and_add(digests(value))
+        index.release(index.state())
+    assert len(index.segments) == 0
+    assert len(list(tmp_path.glob("buffer_*.npy"))) == 1
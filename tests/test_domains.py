@@ -0,0 +1,13 @@
+import pandas as pd
+
+from domains import DomainQuota
+
+
+def test_quota_restored_from_state_keeps_counting():
+    hosts = pd.Series(["a.com", "a.com", "b.com", None])
+    quota = DomainQuota(3)
+    quota.within_quota(hosts)
+
+    restored = DomainQuota(3, quota.state())
+    keep = restored.within_quota(pd.Series(["a.com", "a.com", "b.com", None]))
+    assert keep.tolist() == [True, False, True, True]
@@ -0,0 +1,50 @@
+import pandas as pd
+
+from main import build_stages
+from pipeline import CostClass, Stage, plan_stages, run_pipeline
+from processor import LanguageTool
+
+
+def identity(data: pd.DataFrame) -> pd.DataFrame:
+    return data
+
+
+def test_filters_run_before_cheaper_transforms():
+    stages = [
+        Stage("transform", identity, CostClass.CHEAP, reads=("text",), writes=("a",)),
+        Stage("filter", identity, CostClass.EXPENSIVE, reads=("text",), filters=True),
+    ]
+    assert [stage.name for stage in plan_stages(stages)] == ["filter", "transform"]
+
+
+def test_filters_only_move_past_independent_stages():
+    stages = [
+        Stage("transform", identity, CostClass.CHEAP, reads=("text",), writes=("a",)),
+        Stage("filter", identity, CostClass.CHEAP, reads=("a",), filters=True),
+    ]
+    assert [stage.name for stage in plan_stages(stages)] == ["transform", "filter"]
+
+
+def test_default_stages_tokenise_after_language_filter():
+    config = {"filters": {"detect_code": True}}
+    order = [
+        stage.name for stage in plan_stages(build_stages(config, LanguageTool.LINGUA))
+    ]
+    assert order.index("extract_language") < order.index("check_text_is_code")
+    assert order.index("extract_language") < order.index("tokenise_texts")
+
+
+def test_reordered_pipeline_matches_declared_order():
+    def add_length(data: pd.DataFrame) -> pd.DataFrame:
+        return data.assign(length=data["text"].str.len())
+
+    def drop_short(data: pd.DataFrame) -> pd.DataFrame:
+        return data[data["text"].str.len() > 3]
+
+    stages = [
+        Stage("add_length", add_length, CostClass.CHEAP, ("text",), ("length",)),
+        Stage("drop_short", drop_short, CostClass.EXPENSIVE, ("text",), filters=True),
+    ]
+    data = pd.DataFrame({"text": ["a", "abcd", "ab", "abcdef"]})
+    expected = run_pipeline(data.copy(), stages, reorder=False)
+    pd.testing.assert_frame_equal(run_pipeline(data.copy(), stages), expected)
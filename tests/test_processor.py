@@ -0,0 +1,14 @@
+import pandas as pd
+
+from processor import extract_domain, in_fallback_band
+
+
+def test_certain_english_does_not_fall_back():
+    probs = pd.Series([1.0, 0.0, 0.95, 0.85, 0.8, 0.999])
+    band = in_fallback_band(probs, en_threshold=0.9, fallback_margin=0.1)
+    assert band.tolist() == [False, False, True, True, False, True]
+
+
+def test_extract_domain_matches_column_extraction():
+    assert extract_domain("https://WWW.Example.com:8080/a?b=c") == "example.com"
+    assert extract_domain("https://") is None
@@ -0,0 +1,23 @@
+import pandas as pd
+
+from memory import compact_frame
+from splitting import hash_split
+
+
+def test_hash_split_groups_compacted_frame_with_missing_domains():
+    data = pd.DataFrame(
+        {
+            "text": [f"text {i}" for i in range(8)],
+            "domain": ["a.com", "a.com", None, "", "b.com", None, "b.com", "c.com"],
+        }
+    )
+    expected = hash_split(data.copy(), group_by="domain")
+    compacted = compact_frame(data.copy())
+    assert compacted["domain"].dtype == "category"
+
+    splits = hash_split(compacted, group_by="domain")
+    for split, expected_split in zip(splits, expected):
+        assert split.index.tolist() == expected_split.index.tolist()
+    for domain in ["a.com", "b.com"]:
+        rows = data.index[data["domain"] == domain]
+        assert sum(rows.isin(split.index).all() for split in splits) == 1
@@ -0,0 +1,82 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+URL_RE = re.compile(r"https?://[^\s]+")
+# Word characters that are not digits or underscores: every alphabetic
+# character, plus a few numeric ones such as "½" that need a second check
+WORD_LETTER_RE = re.compile(r"[^\W\d_]")
+
+
+class PrintableTable(dict):
+    """
+    `str.translate` table that deletes the characters `clean_ascii` removes:
+    anything not printable other than newlines, returns and tabs. Entries are
+    filled in the first time a character is seen, so `translate` runs in C.
+    """
+
+    def __missing__(self, codepoint: int) -> int | None:
+        char = chr(codepoint)
+        value = codepoint if char.isprintable() or char in "\n\r\t" else None
+        self[codepoint] = value
+        return value
+
+
+PRINTABLE_TABLE = PrintableTable()
+
+
+def is_printable(text: str) -> bool:
+    """Check, in C, that `clean_ascii` would leave the text unchanged."""
+    return text.replace("\n", "").replace("\r", "").replace("\t", "").isprintable()
+
+
+def clean_ascii(texts: pd.Series) -> pd.Series:
+    """Remove non-printable characters other than newlines, returns and tabs."""
+    return pd.Series(
+        [
+            text if is_printable(text) else text.translate(PRINTABLE_TABLE)
+            for text in texts
+        ],
+        index=texts.index,
+        dtype=texts.dtype,
+    )
+
+
+def any_alphabetic(text: str) -> bool:
+    """Same as `any(c.isalpha() for c in text)`, with the scan done by the regex engine."""
+    match = WORD_LETTER_RE.search(text)
+    if match is None:
+        return False
+    if match.group().isalpha():
+        return True
+    return any(c.isalpha() for c in text[match.end() :])
+
+
+def has_alphabetic(texts: pd.Series) -> pd.Series:
+    """Check which texts contain any alphabetic character."""
+    return pd.Series(
+        [any_alphabetic(text) for text in texts], index=texts.index, dtype=bool
+    )
+
+
+def url_ratio(text: str) -> float:
+    """Fraction of the text made up of URLs."""
+    url_length = sum(len(url) for url in URL_RE.findall(text))
+    return float(url_length) / float(len(text)) if url_length > 0 else 0.0
+
+
+def is_hyperlink(texts: pd.Series, threshold: float = 0.9) -> pd.Series:
+    """Check which texts are made up of URLs for more than `threshold` of their length."""
+    return pd.Series(
+        ["http" in text and url_ratio(text) > threshold for text in texts],
+        index=texts.index,
+        dtype=bool,
+    )
+
+
+def count_words(texts: pd.Series) -> pd.Series:
+    """Count space-separated words, the same as `texts.str.split(" ").str.len()`."""
+    return pd.Series(
+        [text.count(" ") + 1 for text in texts], index=texts.index, dtype=np.int64
+    )
@@ -1,32 +1,114 @@
-import spacy
-import tiktoken
-from nltk.tokenize import word_tokenize
+from functools import lru_cache
+from typing import TYPE_CHECKING, Sequence
+
+import numpy as np
+
+import backends
+
+if TYPE_CHECKING:
+    import spacy
+    import tiktoken
+
+# Pipeline components that do not change tokenisation, skipped when loading spaCy
+SPACY_EXCLUDED_PIPES = [
+    "tok2vec",
+    "tagger",
+    "parser",
+    "senter",
+    "attribute_ruler",
+    "lemmatizer",
+    "ner",
+]
+DEFAULT_MODELS = {"spacy": "en_core_web_sm", "tiktoken": "gpt-4o"}
+
+
+def token_dtype(n_vocab: int) -> np.dtype:
+    """Return the narrowest unsigned dtype holding every token id of a vocabulary."""
+    return np.dtype("<u2") if n_vocab <= 1 << 16 else np.dtype("<u4")
+
+
+@lru_cache(maxsize=None)
+def load_spacy_tokeniser(model: str = "en_core_web_sm") -> "spacy.language.Language":
+    """Load a tokeniser-only spaCy pipeline, once per process."""
+    return backends.load("spacy").load(model, exclude=SPACY_EXCLUDED_PIPES)
+
+
+@lru_cache(maxsize=None)
+def load_tiktoken_encoding(model: str = "gpt-4o") -> "tiktoken.Encoding":
+    """Load the tiktoken encoding for a model, once per process."""
+    return backends.load("tiktoken").encoding_for_model(model)
 
 
 def tokenise_spacy(text: str, model: str = "en_core_web_sm") -> int:
     """Tokenise text using spaCy."""
-    nlp = spacy.load(model)
-    doc = nlp(text)
+    nlp = load_spacy_tokeniser(model)
+    doc = nlp.tokenizer(text)
     return len(doc)
 
 
 def tokenise_nltk(text: str) -> int:
     """Tokenise text using NLTK."""
-    tokens = word_tokenize(text)
+    tokens = backends.load("nltk.tokenize").word_tokenize(text)
     return len(tokens)
 
 
 def tokenise_tiktoken(text: str, model: str = "gpt-4o") -> int:
     """Tokenise text using tiktoken."""
-    encoding = tiktoken.encoding_for_model(model)
-    tokens = encoding.encode(text)
+    encoding = load_tiktoken_encoding(model)
+    tokens = encoding.encode_ordinary(text)
     return len(tokens)
 
 
-if __name__ == "__main__":
-    # Load English tokeniser, tagger, parser and NER
-    nlp = spacy.load("en_core_web_sm")
+def count_tokens(
+    texts: Sequence[str],
+    method: str = "tiktoken",
+    model: str | None = None,
+    batch_size: int = 1000,
+    num_threads: int = 8,
+) -> np.ndarray:
+    """Count the tokens of each text, using the batch API of the chosen tokeniser."""
+    assert method in ["spacy", "nltk", "tiktoken"], (
+        "Invalid tokenisation method, choose from 'spacy', 'nltk', 'tiktoken'"
+    )
+    texts = list(texts)
+    model = model or DEFAULT_MODELS.get(method)
+    if method == "tiktoken":
+        encoding = load_tiktoken_encoding(model)
+        counts = []
+        for start in range(0, len(texts), batch_size):
+            batch = encoding.encode_ordinary_batch(
+                texts[start : start + batch_size], num_threads=num_threads
+            )
+            counts.extend(len(tokens) for tokens in batch)
+    elif method == "spacy":
+        nlp = load_spacy_tokeniser(model)
+        counts = [len(doc) for doc in nlp.tokenizer.pipe(texts, batch_size=batch_size)]
+    else:
+        word_tokenize = backends.load("nltk.tokenize").word_tokenize
+        counts = [len(word_tokenize(text)) for text in texts]
+    return np.asarray(counts, dtype=np.int64)
 
+
+def encode_tokens(
+    texts: Sequence[str],
+    model: str | None = None,
+    batch_size: int = 1000,
+    num_threads: int = 8,
+) -> list[np.ndarray]:
+    """Encode each text into tiktoken ids, stored in `token_dtype` of the vocabulary."""
+    encoding = load_tiktoken_encoding(model or DEFAULT_MODELS["tiktoken"])
+    dtype = token_dtype(encoding.n_vocab)
+    texts = list(texts)
+    ids = []
+    for start in range(0, len(texts), batch_size):
+        batch = encoding.encode_ordinary_batch(
+            texts[start : start + batch_size], num_threads=num_threads
+        )
+        ids.extend(np.asarray(tokens, dtype=dtype) for tokens in batch)
+    return ids
+
+
+if __name__ == "__main__":
     # Process whole documents
     text = (
         "When Sebastian Thrun started working on self-driving cars at "
@@ -40,3 +122,4 @@ if __name__ == "__main__":
     print(f"spaCy tokens: {tokenise_spacy(text)}")
     print(f"NLTK tokens: {tokenise_nltk(text)}")
     print(f"tiktoken tokens: {tokenise_tiktoken(text)}")
+    print(f"tiktoken batch tokens: {count_tokens([text] * 3, method='tiktoken')}")
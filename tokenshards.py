@@ -0,0 +1,200 @@
+import glob
+import json
+import os
+from typing import Iterable, Iterator
+
+import numpy as np
+
+# Each shard's index holds a leading 0 and the token offset at which each
+# document ends, so document i spans offsets[i]:offsets[i + 1]
+OFFSET_DTYPE = np.dtype("<u8")
+DEFAULT_MAX_TOKENS_PER_SHARD = 1 << 30
+
+
+def shard_paths(directory: str, shard: int) -> tuple[str, str]:
+    """Return the token and offset file paths of a shard."""
+    prefix = os.path.join(directory, f"shard_{shard:05d}")
+    return f"{prefix}.bin", f"{prefix}.idx"
+
+
+class TokenShardWriter:
+    """
+    Append the token ids of documents to flat binary shards in `directory`.
+    `shard_NNNNN.bin` holds the ids of consecutive documents and
+    `shard_NNNNN.idx` their offsets, both as raw little-endian arrays written
+    as documents arrive, so shards can be read with `np.memmap`. A document
+    never spans shards; a new shard is started once the current one would
+    exceed `max_tokens_per_shard`. `manifest.json` records the dtype, the
+    tokeniser and the document and token counts of each shard. The dtype is
+    taken from the first ids written unless given. A writer given the `state()`
+    of an earlier writer truncates the shards back to that state and appends.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        tokeniser: str,
+        dtype: np.dtype | None = None,
+        max_tokens_per_shard: int = DEFAULT_MAX_TOKENS_PER_SHARD,
+        resume_state: dict | None = None,
+    ):
+        self.directory = directory
+        self.tokeniser = tokeniser
+        self.dtype = np.dtype(dtype) if dtype is not None else None
+        self.max_tokens_per_shard = max_tokens_per_shard
+        self.shards: list[dict] = []
+        self._bin = None
+        self._idx = None
+        os.makedirs(directory, exist_ok=True)
+        if resume_state is not None:
+            self.shards = [dict(shard) for shard in resume_state["shards"]]
+            if resume_state["dtype"] is not None:
+                self.dtype = np.dtype(resume_state["dtype"])
+        # Drop shards, or the end of the last shard, written after the state
+        for path in glob.glob(os.path.join(directory, "shard_*.*")):
+            if int(os.path.basename(path)[6:11]) >= len(self.shards):
+                os.remove(path)
+        if len(self.shards) > 0:
+            shard = self.shards[-1]
+            bin_path, idx_path = shard_paths(directory, len(self.shards) - 1)
+            with open(bin_path, "r+b") as file:
+                file.truncate(shard["tokens"] * self.dtype.itemsize)
+            with open(idx_path, "r+b") as file:
+                file.truncate((shard["documents"] + 1) * OFFSET_DTYPE.itemsize)
+            self._bin, self._idx = open(bin_path, "ab"), open(idx_path, "ab")
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, "manifest.json")
+
+    @property
+    def resumable(self) -> bool:
+        return True
+
+    def start_shard(self) -> None:
+        self.flush()
+        if self._bin is not None:
+            self._bin.close()
+            self._idx.close()
+        bin_path, idx_path = shard_paths(self.directory, len(self.shards))
+        self._bin, self._idx = open(bin_path, "wb"), open(idx_path, "wb")
+        self._idx.write(np.zeros(1, dtype=OFFSET_DTYPE).tobytes())
+        self.shards.append({"documents": 0, "tokens": 0})
+
+    def write_batch(self, batch: list[np.ndarray]) -> None:
+        """Append documents to the current shard."""
+        shard = self.shards[-1]
+        tokens = np.concatenate(batch).astype(self.dtype, copy=False)
+        ends = shard["tokens"] + np.cumsum([len(ids) for ids in batch])
+        self._bin.write(tokens.tobytes())
+        self._idx.write(ends.astype(OFFSET_DTYPE).tobytes())
+        shard["documents"] += len(batch)
+        shard["tokens"] += len(tokens)
+
+    def write(self, documents: Iterable[np.ndarray]) -> None:
+        """Append the token ids of each document."""
+        batch: list[np.ndarray] = []
+        batch_tokens = 0
+        for ids in documents:
+            if self.dtype is None:
+                self.dtype = np.asarray(ids).dtype
+            if len(self.shards) == 0:
+                self.start_shard()
+            shard = self.shards[-1]
+            tokens = shard["tokens"] + batch_tokens
+            if tokens > 0 and tokens + len(ids) > self.max_tokens_per_shard:
+                if len(batch) > 0:
+                    self.write_batch(batch)
+                batch, batch_tokens = [], 0
+                self.start_shard()
+            batch.append(np.asarray(ids))
+            batch_tokens += len(ids)
+        if len(batch) > 0:
+            self.write_batch(batch)
+
+    def flush(self) -> None:
+        if self._bin is not None:
+            self._bin.flush()
+            self._idx.flush()
+        self.save_manifest()
+
+    def save_manifest(self) -> None:
+        manifest = {
+            "tokeniser": self.tokeniser,
+            "dtype": self.dtype.str if self.dtype is not None else None,
+            "documents": sum(shard["documents"] for shard in self.shards),
+            "tokens": sum(shard["tokens"] for shard in self.shards),
+            "shards": self.shards,
+        }
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def state(self) -> dict:
+        """Return what is needed to resume writing after the documents so far."""
+        self.flush()
+        return {
+            "dtype": self.dtype.str if self.dtype is not None else None,
+            "shards": [dict(shard) for shard in self.shards],
+        }
+
+    def close(self) -> None:
+        self.flush()
+        if self._bin is not None:
+            self._bin.close()
+            self._idx.close()
+        documents = sum(shard["documents"] for shard in self.shards)
+        tokens = sum(shard["tokens"] for shard in self.shards)
+        print(
+            f"\tWrote {tokens} tokens of {documents} documents to "
+            f"{len(self.shards)} shards in {self.directory}"
+        )
+
+
+def memmap_or_empty(path: str, dtype: np.dtype, length: int) -> np.ndarray:
+    # Empty files cannot be memory-mapped
+    if length == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(length,))
+
+
+class TokenShardReader:
+    """
+    Read the documents written by a `TokenShardWriter`. Shards are
+    memory-mapped, and each document is returned as a view into its shard
+    without copying.
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "manifest.json"), "r") as file:
+            self.manifest = json.load(file)
+        self.dtype = np.dtype(self.manifest["dtype"] or "<u4")
+        self.tokens, self.offsets = [], []
+        for i, shard in enumerate(self.manifest["shards"]):
+            bin_path, idx_path = shard_paths(directory, i)
+            self.tokens.append(memmap_or_empty(bin_path, self.dtype, shard["tokens"]))
+            self.offsets.append(
+                memmap_or_empty(idx_path, OFFSET_DTYPE, shard["documents"] + 1)
+            )
+        self.first_documents = np.cumsum(
+            [0] + [shard["documents"] for shard in self.manifest["shards"]]
+        )
+
+    def __len__(self) -> int:
+        return int(self.first_documents[-1])
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"Document {i} out of range for {len(self)} documents")
+        shard = int(np.searchsorted(self.first_documents, i, side="right")) - 1
+        j = i - self.first_documents[shard]
+        offsets = self.offsets[shard]
+        return self.tokens[shard][offsets[j] : offsets[j + 1]]
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for tokens, offsets in zip(self.tokens, self.offsets):
+            for start, end in zip(offsets[:-1], offsets[1:]):
+                yield tokens[start:end]